@@ -26,13 +26,15 @@ class PyBossaLC(Plugin):
         self.setup_blueprints()
         self.setup_enhanced_iiif_importer()
         wa_client.init_app(app)
+        async_wa_client.init_app(app)
+        annotation_journal.init_app(app)
 
     def configure(self):
         """Load configuration settings."""
         settings = [key for key in dir(default_settings) if key.isupper() and
                     not key.startswith('#')]
         for s in settings:
-            if not app.config.get(s):
+            if s not in app.config:
                 app.config[s] = getattr(default_settings, s)
 
     def setup_blueprints(self):
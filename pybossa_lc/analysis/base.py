@@ -9,12 +9,11 @@ One subclass should be provided for each type of task presenter.
 
 import six
 import json
+import itertools
+import collections
 import numpy
-import string
 import pandas
-import dateutil
-import dateutil.parser
-from titlecase import titlecase
+from multiprocessing.pool import ThreadPool
 from flask import current_app, render_template
 from rq import Queue
 from abc import ABCMeta, abstractmethod
@@ -22,6 +21,16 @@ from pybossa.core import sentinel
 from pybossa.jobs import send_mail
 
 from . import AnalysisException
+from . import clustering
+from . import consensus
+from . import normalisation
+from .cache import CreatorCache
+from .queries import iter_empty_result_ids, get_result_task_ids
+from .queries import load_results, update_task_redundancy
+from .queries import load_task_runs
+from .task_runs import TaskRunTable, ANALYSIS_KEYS, PROTECTED_KEYS
+from .. import annotation_journal
+from ..web_annotation_client import wait_for
 from ..model.result_collection import ResultCollection
 
 
@@ -46,27 +55,55 @@ class BaseAnalyst():
         """Return a dataframe of transcriptions."""
         pass
 
-    def analyse(self, result_id, silent=True, analyse_full=False):
-        """Analyse a result."""
-        from .. import wa_client
+    def analyse(self, result_id, silent=True, analyse_full=False,
+                annotations=None):
+        """Analyse a result.
+
+        The task's current Annotations can be given if already fetched. Unless
+        silent, Annotations are written directly rather than journalled, so
+        that any comments emailed have IDs.
+        """
         from pybossa.core import result_repo, task_repo, project_repo
         result = result_repo.get(result_id)
         task = task_repo.get_task(result.task_id)
-        task_runs = task.task_runs
         project = project_repo.get(result.project_id)
         category = project_repo.get_category(project.category_id)
-        rc = self._get_rc(category)
-        annotations = rc.get_by_task_id(task.id)
+        rc = self._get_rc(category, write_behind=silent)
+        tmpl = self.get_project_template(project)
+        task_runs = load_task_runs([task.id])[task.id]
+        try:
+            self._analyse_result(result, task, task_runs, rc, tmpl, silent,
+                                 analyse_full, annotations)
+        except BaseException:
+            self._flush_after_error(rc)
+            raise
+        rc.flush()
+
+    def _analyse_result(self, result, task, task_runs, rc, tmpl, silent=True,
+                        analyse_full=False, annotations=None,
+                        task_updates=None, creators=None,
+                        task_run_table=None):
+        """Analyse a result that has been loaded with its task runs.
+
+        If a task_updates list is given any redundancy changes for the task
+        are appended to it, rather than being saved immediately. A
+        CreatorCache can be given to share commenting users across results,
+        and the task runs' TaskRunTable if it has already been built.
+
+        Only the Annotations that have changed are deleted and added, unless
+        ANALYSIS_REPLACE_ANNOTATIONS is set.
+        """
+        from pybossa.core import result_repo
+        if annotations is None:
+            annotations = rc.get_by_task_id(task.id)
 
         can_update = self._can_update_result(result, annotations, analyse_full)
         if not can_update:
             return
 
-        if annotations:
-            rc.delete_batch(annotations)
-
-        tr_df = self.get_task_run_df(task, task_runs)
-        tmpl = self.get_project_template(project)
+        tr_df = task_run_table
+        if tr_df is None:
+            tr_df = self.get_task_run_table(task, task_runs)
         target = self.get_task_target(task)
 
         # Apply rule to strip fragment selectors
@@ -75,32 +112,158 @@ class BaseAnalyst():
             target = self.strip_fragment_selector(target)
 
         new_info = result.info.copy() if result.info else {}
+        new_annotations = []
         rejected = self._get_rejected_reason(tr_df, tmpl['min_answers'])
         if rejected:
             new_info['rejected'] = rejected
         else:
-            self._handle_comments(rc, task, tr_df, target, silent)
-            self._handle_tags(rc, task, tr_df, target)
-            self._handle_transcriptions(rc, task, tr_df, target, tmpl)
+            new_annotations += self._handle_comments(rc, task, tr_df, target,
+                                                     creators)
+            new_annotations += self._handle_tags(rc, task, tr_df, target)
+            new_annotations += self._handle_transcriptions(rc, task, tr_df,
+                                                           target, tmpl,
+                                                           task_updates)
+
+        if not current_app.config.get('ANALYSIS_REPLACE_ANNOTATIONS'):
+            annotations, new_annotations = self.diff_annotations(
+                annotations, new_annotations)
+        if annotations:
+            rc.delete_batch(annotations)
+        if new_annotations:
+            created = rc.add_batch(new_annotations)
+            if not silent:
+                self._email_comments(task, created)
 
         new_info['annotations'] = rc.iri
-        result.info = new_info
-        result_repo.update(result)
+        if new_info != result.info:
+            result.info = new_info
+            result_repo.update(result)
 
     def analyse_all(self, project_id):
         """Analyse all results for a project."""
-        from pybossa.core import result_repo
-        results = result_repo.filter_by(project_id=project_id)
-        for result in results:
-            self.analyse(result.id, analyse_full=True)
+        rc, tmpl = self._get_project_rc_and_template(project_id)
+        rows = get_result_task_ids(project_id)
+        index = rc.get_by_task_ids([task_id for _, task_id in rows])
+        items = [(result_id, dict(analyse_full=True,
+                                  annotations=index.get(task_id, [])))
+                 for result_id, task_id in rows]
+        try:
+            self._analyse_concurrently(items, rc, tmpl)
+        except BaseException:
+            self._flush_after_error(rc)
+            raise
+        rc.flush()
 
     def analyse_empty(self, project_id):
         """Analyse all empty results for a project."""
-        from pybossa.core import result_repo
-        results = result_repo.filter_by(project_id=project_id)
-        empty_results = [r for r in results if not r.info]
-        for result in empty_results:
-            self.analyse(result.id)
+        rc, tmpl = self._get_project_rc_and_template(project_id)
+        result_ids = iter_empty_result_ids(project_id)
+        items = ((result_id, {}) for result_id in result_ids)
+        try:
+            self._analyse_concurrently(items, rc, tmpl)
+        except BaseException:
+            self._flush_after_error(rc)
+            raise
+        rc.flush()
+
+    def _flush_after_error(self, rc):
+        """Send any journalled writes after analysis has failed.
+
+        The results saved before the error then keep their Annotations. Any
+        error from the flush is logged, so as not to mask the original.
+        """
+        try:
+            rc.flush()
+        except Exception as err:
+            msg = 'Failed to flush the annotation journal: {}'
+            current_app.logger.error(msg.format(err))
+
+    def _analyse_concurrently(self, items, rc, tmpl):
+        """Analyse chunks of a project's results concurrently.
+
+        Each item is a tuple of a result ID and the keyword arguments to
+        analyse it with. The results, tasks and task runs for each chunk are
+        loaded together, then analysed in a worker thread with its own app
+        context, and so its own database session. Redundancy changes for the
+        chunk's tasks are saved together once the chunk has been analysed.
+        The users who commented in the task runs of each chunk's updatable
+        results are loaded together, and their creators are cached across
+        chunks.
+
+        Chunks are only loaded as workers become free, so that on any error,
+        such as a job timeout, the remaining chunks can be abandoned.
+        """
+        app = current_app._get_current_object()
+        chunk_size = app.config.get('ANALYSIS_CHUNK_SIZE', 100)
+        n_workers = app.config.get('ANALYSIS_WORKERS', 4)
+        items = iter(items)
+        chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+        creators = CreatorCache(rc)
+
+        def analyse_chunk(chunk):
+            loaded = load_results([result_id for result_id, _ in chunk])
+            tables = {}
+            commenters = set()
+            for result_id, kwargs in chunk:
+                result, task, task_runs = loaded[result_id]
+                annotations = kwargs.get('annotations') or []
+                analyse_full = kwargs.get('analyse_full', False)
+                if not self._can_update_result(result, annotations,
+                                               analyse_full):
+                    continue
+                try:
+                    table = self.get_task_run_table(task, task_runs)
+                    comments = self.get_comments(table) or []
+                except Exception:
+                    continue  # Raised again if the result is analysed
+                tables[result_id] = table
+                commenters.update(user_id for user_id, val in comments if val)
+            creators.prefetch(commenters)
+            task_updates = []
+            try:
+                for result_id, kwargs in chunk:
+                    result, task, task_runs = loaded[result_id]
+                    self._analyse_result(result, task, task_runs, rc, tmpl,
+                                         task_updates=task_updates,
+                                         creators=creators,
+                                         task_run_table=tables.get(result_id),
+                                         **kwargs)
+            finally:
+                update_task_redundancy(task_updates)
+
+        if n_workers <= 1:
+            for chunk in chunks:
+                analyse_chunk(chunk)
+            return
+
+        def analyse_chunk_in_context(chunk):
+            with app.app_context():
+                analyse_chunk(chunk)
+
+        pool = ThreadPool(n_workers)
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                if len(pending) >= n_workers:
+                    wait_for(pending.popleft())
+                pending.append(pool.apply_async(analyse_chunk_in_context,
+                                                (chunk,)))
+            while pending:
+                wait_for(pending.popleft())
+        except BaseException:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+
+    def _get_project_rc_and_template(self, project_id):
+        """Return the ResultCollection and template shared by a project."""
+        from pybossa.core import project_repo
+        project = project_repo.get(project_id)
+        category = project_repo.get_category(project.category_id)
+        rc = self._get_rc(category)
+        tmpl = self.get_project_template(project)
+        return rc, tmpl
 
     def _can_update_result(self, result, annotations, analyse_full):
         """Check if a result can be updated."""
@@ -113,77 +276,134 @@ class BaseAnalyst():
             return False
         return True
 
+    def diff_annotations(self, old_annotations, new_annotations):
+        """Return the old Annotations to delete and new Annotations to add.
+
+        Old Annotations that match a new Annotation are kept, rather than
+        being deleted and added again.
+        """
+        unmatched = {}
+        for i, anno in enumerate(old_annotations):
+            key = self.get_annotation_key(anno)
+            unmatched.setdefault(key, []).append(i)
+
+        kept = set()
+        to_add = []
+        for anno in new_annotations:
+            indexes = unmatched.get(self.get_annotation_key(anno))
+            if indexes:
+                kept.add(indexes.pop())
+            else:
+                to_add.append(anno)
+        to_delete = [anno for i, anno in enumerate(old_annotations)
+                     if i not in kept]
+        return to_delete, to_add
+
+    def get_annotation_key(self, anno):
+        """Return the parts of an Annotation that are compared on analysis.
+
+        These are the motivation, the target and the value of each body,
+        including any tag.
+        """
+        body = anno.get('body')
+        bodies = body if isinstance(body, list) else [body]
+        values = tuple(sorted((b.get('purpose'), b.get('value'))
+                              for b in bodies if isinstance(b, dict)))
+        target = json.dumps(anno.get('target'), sort_keys=True)
+        return anno.get('motivation'), target, values
+
     def _get_rejected_reason(self, task_run_df, n_answers):
         """Handle and rejection ."""
         try:
-            reasons = task_run_df['reject'].tolist()
+            reasons = list(task_run_df['reject'])
             if len(reasons) >= n_answers:
                 return max(reasons)
         except KeyError:
             return None
 
     def _handle_comments(self, result_collection, task, task_run_df, target,
-                         silent):
-        """Handle creation of any comment Annotations."""
-        from pybossa.core import user_repo
+                         creators=None):
+        """Return any new commenting Annotations."""
         comments = self.get_comments(task_run_df)
+        annotations = []
         if comments:
+            if creators is None:
+                creators = CreatorCache(result_collection)
+            creators.prefetch(user_id for user_id, val in comments if val)
             for comment in comments:
                 user_id = comment[0]
                 val = comment[1]
-                user = user_repo.get(user_id) if user_id else None
                 if not val:
                     continue
-                anno = result_collection.add_comment(task, target, val, user)
-                if not silent:
-                    self.email_comment_anno(task, anno)
+                creator = creators.get(user_id)
+                anno = result_collection.new_comment(task, target, val,
+                                                     creator=creator)
+                annotations.append(anno)
+        return annotations
 
     def _handle_tags(self, result_collection, task, task_run_df, target):
-        """Handle creation of any tagging Annotations."""
+        """Return any new tagging Annotations."""
         tags = self.get_tags(task_run_df)
         annotations = []
         if tags:
             for tag, rects in tags.items():
                 clusters = self.cluster_rects(rects)
                 for cluster in clusters:
-                    anno = result_collection.add_tag(task, target, tag,
+                    anno = result_collection.new_tag(task, target, tag,
                                                      cluster)
                     annotations.append(anno)
         return annotations
 
     def _handle_transcriptions(self, result_collection, task, task_run_df,
-                               target, tmpl):
-        """Handle creation of any transcription Annotations."""
+                               target, tmpl, task_updates=None):
+        """Return any new describing Annotations."""
         df = self.get_transcriptions_df(task_run_df)
         df = self.drop_empty_rows(df)
-        rules = tmpl['rules']
-        df = df.applymap(lambda x: self.normalise_transcription(x, rules))
+        df = df.applymap(self.get_normaliser(tmpl['rules']))
 
         annotations = []
         is_complete = True
-        has_matches = self.has_n_matches(tmpl['min_answers'], df)
+        strategy = self.get_consensus_strategy(tmpl['rules'])
+        has_matches, values = consensus.get_consensus(df, tmpl['min_answers'],
+                                                      strategy)
         if has_matches:
-            for column in df:
-                value = df[column].value_counts().idxmax()
-                anno = result_collection.add_transcription(task, target, value,
-                                                           column)
+            for column, value in values.items():
+                anno = result_collection.new_transcription(task, target,
+                                                           value, column)
                 annotations.append(anno)
         elif not df.empty:
             is_complete = False
 
-        self.update_n_answers_required(task, is_complete, tmpl['max_answers'])
+        n_task_runs = len(task_run_df)
+        if task_updates is None:
+            self.update_n_answers_required(task, is_complete,
+                                           tmpl['max_answers'], n_task_runs)
+        else:
+            state, n_answers = self.get_n_answers_required(
+                task, is_complete, tmpl['max_answers'], n_task_runs)
+            task_updates.append(dict(id=task.id, project_id=task.project_id,
+                                     state=state, n_answers=n_answers))
         return annotations
 
-    def _get_rc(self, category):
+    def _email_comments(self, task, annotations):
+        """Email any commenting Annotations to administrators."""
+        for anno in annotations:
+            if anno.get('motivation') == 'commenting':
+                self.email_comment_anno(task, anno)
+
+    def _get_rc(self, category, write_behind=True):
         """Return an AnnotationCollection for the results.
 
-        The AnnotationCollection IRI should be set from the frontend.
+        The AnnotationCollection IRI should be set from the frontend. If
+        write_behind is True writes are buffered in the annotation journal,
+        if configured.
         """
         iri = category.info.get('annotations', {}).get('results')
         if not iri:
             raise AnalysisException('AnnotationCollection not setup')
 
-        return ResultCollection(iri)
+        write_behind = write_behind and annotation_journal.enabled
+        return ResultCollection(iri, write_behind=write_behind)
 
     def drop_keys(self, task_run_df, keys):
         """Drop keys from the info fields of a task run dataframe."""
@@ -208,31 +428,38 @@ class BaseAnalyst():
 
     def has_n_matches(self, min_answers, task_run_df):
         """Check if minimum matching answers for each key."""
-        task_run_df = task_run_df.replace(numpy.nan, '')
-        if task_run_df.empty:
-            return False
-        for k in task_run_df.keys():
-            if task_run_df[k].value_counts().max() < min_answers:
-                return False
-        return True
+        return consensus.get_consensus(task_run_df, min_answers)[0]
 
     def get_task_run_df(self, task, task_runs):
         """Load task run info into a dataframe."""
+        return self.get_task_run_table(task, task_runs).to_dataframe()
+
+    def get_task_run_table(self, task, task_runs):
+        """Load task run info into a TaskRunTable."""
         if not task_runs:
             msg = 'Task {} has no task runs!'.format(task.id)
             raise AnalysisException(msg)
 
         data = [self.explode_info(tr) for tr in task_runs]
-        index = [tr.__dict__['id'] for tr in task_runs]
-        return pandas.DataFrame(data, index)
+        index = [tr.id for tr in task_runs]
+        return TaskRunTable(data, index)
+
+    def to_dataframe(self, task_run_df):
+        """Return task runs as a dataframe, if not one already."""
+        if isinstance(task_run_df, TaskRunTable):
+            return task_run_df.to_dataframe()
+        return task_run_df
 
     def explode_info(self, item):
-        """Explode first level item info keys."""
-        item_data = item.__dict__
-        protected = item_data.keys()
+        """Return a new dict of the item's analysis keys and info keys.
+
+        The item may be a task run or a row with the same columns, and is
+        not modified.
+        """
+        item_data = {key: getattr(item, key) for key in ANALYSIS_KEYS}
         if type(item.info) == dict:
-            for k, v in item_data['info'].items():
-                if k in protected:
+            for k, v in item.info.items():
+                if k in PROTECTED_KEYS:
                     # Prefix if info key also exists as core task run key
                     item_data["_" + k] = v
                 else:
@@ -251,87 +478,77 @@ class BaseAnalyst():
 
     def normalise_case(self, value, rules):
         """Normalise the case of a string."""
-        if rules.get('case') == 'title':
-            return titlecase(value.lower())
-        elif rules.get('case') == 'lower':
-            return value.lower()
-        elif rules.get('case') == 'upper':
-            return value.upper()
-        return value
+        func = normalisation.CASE.get(rules.get('case'))
+        return func(value) if func else value
 
     def normalise_whitespace(self, value, rules):
         """Normalise the whitespace of a string."""
-        if rules.get('whitespace') == 'normalise':
-            return " ".join(value.split())
-        elif rules.get('whitespace') == 'underscore':
-            return " ".join(value.split()).replace(' ', '_')
-        elif rules.get('whitespace') == 'full_stop':
-            return " ".join(value.split()).replace(' ', '.')
-        return value
+        func = normalisation.WHITESPACE.get(rules.get('whitespace'))
+        return func(value) if func else value
 
     def normalise_dates(self, value, rules):
         """Normalise a date string."""
         if not rules.get('date_format'):
             return value
-
-        # Trim trailing whitespace
-        value = " ".join(value.split())
-
-        # Strip punctuation
-        value = value.strip(string.punctuation)
-
-        # Ensure we have at least four digits
-        if len(value) < 4:
-            return ''
-
-        dayfirst = rules.get('dayfirst', False)
-        yearfirst = rules.get('yearfirst', False)
-        try:
-            ts = dateutil.parser.parse(value, dayfirst=dayfirst,
-                                       yearfirst=yearfirst)
-        except (ValueError, TypeError):
-            return ''
-        iso = ts.isoformat()[:10]
-
-        # Strip the year if it was not given
-        no_start_year = yearfirst and not value.startswith(str(ts.year))
-        no_end_year = not yearfirst and not value.endswith(str(ts.year))
-        if no_start_year or no_end_year:
-            iso = iso[4:]
-
-        return iso
+        return normalisation.normalise_date(value,
+                                            rules.get('dayfirst', False),
+                                            rules.get('yearfirst', False))
 
     def normalise_punctuation(self, value, rules):
         """Normalise string punctuation."""
         if rules.get('trim_punctuation'):
-            return value.strip(string.punctuation)
+            return normalisation.trim_punctuation(value)
         return value
 
     def normalise_transcription(self, value, rules):
         """Normalise value according to the specified analysis rules."""
-        if not rules or not isinstance(value, basestring):
-            return value
+        return self.get_normaliser(rules)(value)
 
-        normalised = value
-        normalised = self.normalise_case(normalised, rules)
-        normalised = self.normalise_whitespace(normalised, rules)
-        normalised = self.normalise_punctuation(normalised, rules)
-        normalised = self.normalise_dates(normalised, rules)
-        return normalised
+    def get_normaliser(self, rules):
+        """Return a callable that normalises values according to the rules.
+
+        The Normaliser is shared by each result analysed with the same rules,
+        along with its cache of normalised values.
+        """
+        return normalisation.get_normaliser(rules)
 
-    def update_n_answers_required(self, task, is_complete, max_answers=10):
-        """Update number of answers required for a task."""
+    def get_consensus_strategy(self, rules):
+        """Return the strategy used to find matching transcriptions.
+
+        The strategy is chosen by the consensus rule, which may be exact,
+        edit_distance or token_set.
+        """
+        return consensus.get_strategy(rules)
+
+    def update_n_answers_required(self, task, is_complete, max_answers=10,
+                                  n_task_runs=None):
+        """Update number of answers required for a task.
+
+        The task runs are counted if the number is not given.
+        """
         from pybossa.core import task_repo
-        task_runs = task_repo.filter_task_runs_by(task_id=task.id)
-        n_task_runs = len(task_runs)
+        if n_task_runs is None:
+            task_runs = task_repo.filter_task_runs_by(task_id=task.id)
+            n_task_runs = len(task_runs)
+        state, n_answers = self.get_n_answers_required(task, is_complete,
+                                                       max_answers,
+                                                       n_task_runs)
+        task.state = state
+        task.n_answers = n_answers
+        task_repo.update(task)
+
+    def get_n_answers_required(self, task, is_complete, max_answers,
+                               n_task_runs):
+        """Return the new state and number of answers required for a task."""
+        n_answers = task.n_answers
         if not is_complete and task.n_answers < max_answers:
-            task.state = "ongoing"
+            state = "ongoing"
             if n_task_runs >= task.n_answers:
-                task.n_answers = task.n_answers + 1
+                n_answers = task.n_answers + 1
         else:
-            task.n_answers = len(task_runs)
-            task.state = "completed"
-        task_repo.update(task)
+            n_answers = n_task_runs
+            state = "completed"
+        return state, n_answers
 
     def replace_df_keys(self, df, **kwargs):
         """Replace a set of keys in a dataframe."""
@@ -402,26 +619,9 @@ class BaseAnalyst():
             'h': max(r1['y'] + r1['h'], r2['y'] + r2['h']) - r2['y']
         }
 
-    def cluster_rects(self, rects):
+    def cluster_rects(self, rects, merge_ratio=0.5):
         """Return clustered rectangles."""
-        clusters = []
-        merge_ratio = 0.5
-
-        for rect in rects:
-            r1 = rect
-            matched = False
-            for i in range(len(clusters)):
-                r2 = clusters[i]
-                overlap_ratio = self.get_overlap_ratio(r1, r2)
-                if overlap_ratio > merge_ratio:
-                    matched = True
-                    r3 = self.merge_rects(r1, r2)
-                    clusters[i] = r3
-
-            if not matched:
-                clusters.append(rect)
-
-        return clusters
+        return clustering.cluster_rects(rects, merge_ratio)
 
     def email_comment_anno(self, task, anno):
         """Email a comment annotation to administrators."""
@@ -0,0 +1,76 @@
+# -*- coding: utf8 -*-
+"""Cache module for pybossa-lc analysis."""
+
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """A thread-safe cache that discards the least recently used items."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Return an item, marking it as the most recently used."""
+        with self._lock:
+            try:
+                value = self._items.pop(key)
+            except KeyError:
+                return default
+            self._items[key] = value
+            return value
+
+    def set(self, key, value):
+        """Add an item, discarding the least recently used if full."""
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+class CreatorCache(object):
+    """A cache of Annotation creators for the users who made task runs.
+
+    Users are loaded in bulk, with only the columns needed for a creator,
+    and each creator is made once for as long as it is cached.
+    """
+
+    _missing = object()
+
+    def __init__(self, result_collection, max_size=10000):
+        self.result_collection = result_collection
+        self._creators = LRUCache(max_size)
+
+    def prefetch(self, user_ids):
+        """Load the creators for a set of users that are not yet cached."""
+        from .queries import load_users
+        missing = [user_id for user_id in set(user_ids)
+                   if user_id and
+                   self._creators.get(user_id, self._missing) is self._missing]
+        if not missing:
+            return
+
+        users = load_users(missing)
+        for user_id in missing:
+            user = users.get(user_id)
+            creator = None
+            if user:
+                creator = self.result_collection._get_creator(user)
+            self._creators.set(user_id, creator)
+
+    def get(self, user_id):
+        """Return the creator for a user, or None if there is no such user."""
+        if not user_id:
+            return None
+        creator = self._creators.get(user_id, self._missing)
+        if creator is self._missing:
+            self.prefetch([user_id])
+            creator = self._creators.get(user_id)
+        return creator
@@ -0,0 +1,150 @@
+# -*- coding: utf8 -*-
+"""Rectangle clustering module for pybossa-lc.
+
+Clusters the rectangles that volunteers draw around the regions of an
+image they have tagged, so that one tagging Annotation can be created for
+each region.
+
+Rectangles are clustered if the ratio of the intersection of their areas
+to the union of their areas (their overlap ratio) is greater than the
+merge ratio. Each cluster is the bounding box of all rectangles connected
+in this way, so the clusters do not depend on the order of the input.
+
+For larger sets of rectangles a grid index is used so that only
+rectangles sharing a grid cell are compared. Rectangles much larger than
+most would cover too many cells, so are compared with every rectangle.
+"""
+
+import itertools
+import numpy
+
+#: Number of rectangles above which candidate pairs are found via a grid.
+GRID_THRESHOLD = 64
+
+#: Number of grid cells above which a box is compared with every box.
+MAX_CELLS_PER_BOX = 16
+
+
+def to_boxes(rects):
+    """Return an (n, 4) array of (x1, y1, x2, y2) for a list of rects."""
+    return numpy.array([[r['x'], r['y'], r['x'] + r['w'], r['y'] + r['h']]
+                        for r in rects], dtype=float).reshape(-1, 4)
+
+
+def overlap_ratios(a, b):
+    """Return the overlap ratios of two broadcastable arrays of boxes."""
+    x_overlap = numpy.minimum(a[..., 2], b[..., 2])
+    x_overlap -= numpy.maximum(a[..., 0], b[..., 0])
+    y_overlap = numpy.minimum(a[..., 3], b[..., 3])
+    y_overlap -= numpy.maximum(a[..., 1], b[..., 1])
+    intersection = numpy.clip(x_overlap, 0, None)
+    intersection *= numpy.clip(y_overlap, 0, None)
+
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - intersection
+    ratios = numpy.zeros_like(intersection)
+    numpy.divide(intersection, union, out=ratios, where=union > 0)
+    return ratios
+
+
+def overlap_matrix(boxes_a, boxes_b):
+    """Return the matrix of overlap ratios between two arrays of boxes."""
+    return overlap_ratios(boxes_a[:, numpy.newaxis, :],
+                          boxes_b[numpy.newaxis, :, :])
+
+
+def get_grid_pairs(boxes):
+    """Return index arrays (i, j), i < j, of boxes sharing a grid cell.
+
+    The cell size is the median box dimension, so most boxes cover only a
+    few cells and boxes that do not share a cell cannot intersect. Boxes
+    covering more than MAX_CELLS_PER_BOX cells are paired with every other
+    box instead of being added to the grid.
+    """
+    sizes = numpy.concatenate([boxes[:, 2] - boxes[:, 0],
+                               boxes[:, 3] - boxes[:, 1]])
+    cell_size = max(numpy.median(sizes), 1.0)
+    cells = numpy.floor(boxes / cell_size).astype(int)
+    n_cells = ((cells[:, 2] - cells[:, 0] + 1) *
+               (cells[:, 3] - cells[:, 1] + 1))
+    large = n_cells > MAX_CELLS_PER_BOX
+
+    grid = {}
+    for idx in numpy.flatnonzero(~large):
+        cx1, cy1, cx2, cy2 = cells[idx]
+        for cell in itertools.product(range(cx1, cx2 + 1),
+                                      range(cy1, cy2 + 1)):
+            grid.setdefault(cell, []).append(int(idx))
+
+    pairs = set()
+    for members in grid.values():
+        pairs.update(itertools.combinations(members, 2))
+    for idx in numpy.flatnonzero(large):
+        pairs.update((min(idx, other), max(idx, other))
+                     for other in range(len(boxes)) if other != idx)
+    if not pairs:
+        empty = numpy.array([], dtype=int)
+        return empty, empty
+    i, j = numpy.array(sorted(pairs), dtype=int).T
+    return i, j
+
+
+def get_overlapping_pairs(boxes, merge_ratio):
+    """Return index arrays (i, j), i < j, of boxes that should be merged."""
+    if len(boxes) <= GRID_THRESHOLD or merge_ratio < 0:
+        ratios = overlap_matrix(boxes, boxes)
+        i, j = numpy.nonzero(numpy.triu(ratios > merge_ratio, k=1))
+        return i, j
+
+    i, j = get_grid_pairs(boxes)
+    merge = overlap_ratios(boxes[i], boxes[j]) > merge_ratio
+    return i[merge], j[merge]
+
+
+def label_components(n, pairs):
+    """Return an array labelling the connected components of a graph.
+
+    Labels are the lowest node index in each component.
+    """
+    parents = numpy.arange(n)
+
+    def find(node):
+        root = node
+        while parents[root] != root:
+            root = parents[root]
+        while parents[node] != root:
+            parents[node], node = root, parents[node]
+        return root
+
+    for i, j in zip(*pairs):
+        root_i = find(i)
+        root_j = find(j)
+        if root_i != root_j:
+            parents[max(root_i, root_j)] = min(root_i, root_j)
+    return numpy.array([find(node) for node in range(n)])
+
+
+def cluster_rects(rects, merge_ratio=0.5):
+    """Return clustered rectangles, sorted by position."""
+    if not rects:
+        return []
+
+    boxes = to_boxes(rects)
+    pairs = get_overlapping_pairs(boxes, merge_ratio)
+    labels = label_components(len(boxes), pairs)
+
+    order = numpy.argsort(labels, kind='mergesort')
+    starts = numpy.flatnonzero(numpy.diff(labels[order], prepend=-1))
+    mins = numpy.minimum.reduceat(boxes[order, :2], starts)
+    maxs = numpy.maximum.reduceat(boxes[order, 2:], starts)
+
+    clusters = []
+    for (x1, y1), (x2, y2) in zip(mins, maxs):
+        clusters.append({
+            'x': int(x1),
+            'y': int(y1),
+            'w': int(x2 - x1),
+            'h': int(y2 - y1)
+        })
+    return sorted(clusters, key=lambda c: (c['x'], c['y'], c['w'], c['h']))
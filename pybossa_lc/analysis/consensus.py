@@ -0,0 +1,218 @@
+# -*- coding: utf8 -*-
+"""Consensus module for pybossa-lc.
+
+Finds the values that volunteers agree on for each field of a set of
+transcriptions.
+
+The values of each field are counted in a single pass, giving both the
+number of times the modal value was given, used to decide whether enough
+volunteers agree, and the modal value itself.
+
+Values match exactly by default. A template's rules can instead choose a
+fuzzy consensus strategy, where values match if they are within an edit
+distance of each other, or share enough of the same words.
+"""
+
+import re
+import six
+from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+
+from . import AnalysisException
+
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def get_consensus(df, min_answers, strategy=None):
+    """Return whether each field has enough matching values, and the values.
+
+    Missing values are counted as empty strings when checking for matches,
+    but are never chosen as the value for a field. Returns a tuple of a
+    boolean and an ordered dict of fields against values.
+    """
+    get_field_mode = strategy.get_mode if strategy else get_mode
+    values = OrderedDict()
+    if df.empty:
+        return False, values
+
+    has_matches = True
+    for column in df:
+        count, value = get_field_mode(df[column])
+        if count < min_answers:
+            has_matches = False
+        values[column] = value
+    return has_matches, values
+
+
+def get_mode(values):
+    """Return the count of the modal value and the modal present value.
+
+    Missing values are counted as empty strings. Where values are tied the
+    first to reach the highest count is chosen.
+    """
+    counts = {}
+    present_counts = {}
+    max_count = 0
+    mode = None
+    max_present_count = 0
+    for value in values:
+        is_missing = value is None or value != value
+        key = '' if is_missing else value
+        counts[key] = count = counts.get(key, 0) + 1
+        if count > max_count:
+            max_count = count
+        if not is_missing:
+            present_counts[key] = count = present_counts.get(key, 0) + 1
+            if count > max_present_count:
+                max_present_count = count
+                mode = key
+    return max_count, mode
+
+
+def get_strategy(rules):
+    """Return the consensus strategy chosen by a template's rules."""
+    rules = rules if isinstance(rules, dict) else {}
+    name = rules.get('consensus') or 'exact'
+    if name == 'exact':
+        return ExactConsensus()
+    elif name == 'edit_distance':
+        return EditDistanceConsensus(rules.get('max_distance', 1))
+    elif name == 'token_set':
+        return TokenSetConsensus(rules.get('min_similarity', 0.8))
+    msg = 'Invalid consensus rule: {}'.format(name)
+    raise AnalysisException(msg)
+
+
+def within_distance(a, b, max_distance):
+    """Check if the edit distance between two strings is within a maximum.
+
+    Only the band of the Levenshtein matrix within max_distance of the
+    diagonal is computed, and the check stops as soon as every cell in a
+    row exceeds the maximum.
+    """
+    if a == b:
+        return True
+    len_a = len(a)
+    len_b = len(b)
+    if abs(len_a - len_b) > max_distance:
+        return False
+
+    too_far = max_distance + 1
+    previous = [j if j <= max_distance else too_far
+                for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        current = [too_far] * (len_b + 1)
+        if i <= max_distance:
+            current[0] = i
+        lowest = current[0]
+        for j in range(max(1, i - max_distance),
+                       min(len_b, i + max_distance) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + cost, too_far)
+            lowest = min(lowest, current[j])
+        if lowest > max_distance:
+            return False
+        previous = current
+    return previous[len_b] <= max_distance
+
+
+class ExactConsensus(object):
+    """Find the values that volunteers agree on exactly."""
+
+    def get_mode(self, values):
+        """Return the count of the modal value and the modal present value."""
+        return get_mode(values)
+
+
+@six.add_metaclass(ABCMeta)
+class FuzzyConsensus(object):
+    """Find the values that volunteers agree on approximately.
+
+    Each distinct value is supported by every value that it matches. The
+    count is that of the best supported value, and the mode is the best
+    supported present value, preferring the value given most often where
+    values are equally supported. Missing and empty values only match each
+    other, as do values that are not strings.
+    """
+
+    @abstractmethod
+    def matches(self, a, b):  # pragma: no cover
+        """Check if two distinct strings match."""
+        pass
+
+    def prepare(self, value):
+        """Return a value in the form compared by matches."""
+        return value
+
+    def get_mode(self, values):
+        """Return the count of the best supported value and present value."""
+        counts = OrderedDict()
+        for value in values:
+            is_missing = value is None or value != value
+            key = '' if is_missing else value
+            count, n_present = counts.get(key, (0, 0))
+            counts[key] = (count + 1, n_present + int(not is_missing))
+
+        keys = counts.keys()
+        prepared = [self.prepare(key) if self._is_fuzzy(key) else None
+                    for key in keys]
+        support = [count for count, _n_present in counts.values()]
+        for i in range(len(keys)):
+            if prepared[i] is None:
+                continue
+            for j in range(i + 1, len(keys)):
+                if prepared[j] is None:
+                    continue
+                if self.matches(prepared[i], prepared[j]):
+                    support[i] += counts[keys[j]][0]
+                    support[j] += counts[keys[i]][0]
+
+        max_count = max(support) if support else 0
+        mode = None
+        best = (0, 0)
+        for key, (_count, n_present), key_support in zip(keys,
+                                                         counts.values(),
+                                                         support):
+            if n_present and (key_support, n_present) > best:
+                best = (key_support, n_present)
+                mode = key
+        return max_count, mode
+
+    def _is_fuzzy(self, value):
+        """Check if a value can match values other than itself."""
+        return isinstance(value, basestring) and value != ''
+
+
+class EditDistanceConsensus(FuzzyConsensus):
+    """Match values within a maximum Levenshtein distance of each other."""
+
+    def __init__(self, max_distance=1):
+        self.max_distance = max_distance
+
+    def matches(self, a, b):
+        """Check if two strings are within the maximum edit distance."""
+        return within_distance(a, b, self.max_distance)
+
+
+class TokenSetConsensus(FuzzyConsensus):
+    """Match values whose sets of words are similar enough.
+
+    Similarity is the Jaccard index of the lower case words in each value,
+    ignoring punctuation.
+    """
+
+    def __init__(self, min_similarity=0.8):
+        self.min_similarity = min_similarity
+
+    def prepare(self, value):
+        """Return the set of lower case words in a value."""
+        return frozenset(WORD_RE.findall(value.lower()))
+
+    def matches(self, a, b):
+        """Check if two sets of words are similar enough."""
+        union = len(a | b)
+        if not union:
+            return True
+        return len(a & b) / float(union) >= self.min_similarity
@@ -2,7 +2,7 @@
 """IIIF Annotation analysis module."""
 
 import pandas
-import itertools
+from collections import defaultdict
 
 from .base import BaseAnalyst
 from . import AnalysisException
@@ -12,61 +12,64 @@ class IIIFAnnotationAnalyst(BaseAnalyst):
 
     def _validate(self, task_run_df):
         """Verify that all info fields are lists."""
-        for v in task_run_df['info'].tolist():
+        for v in task_run_df['info']:
             ty = type(v)
             if not ty == list:
                 msg = ('Invalid task run: info must be {0}, '
                        'not {1}'.format(list, ty))
                 raise AnalysisException(msg)
 
-        if not all(type(v) == list for v in task_run_df['info'].tolist()):
-            msg = "Invalid task runs: info must be a list"
-            raise AnalysisException(msg)
+    def _get_annotations(self, task_run_df):
+        """Return the task run annotations grouped by motivation.
+
+        Each group is a list of (user_id, annotation) tuples. The info fields
+        are validated and grouped in a single pass, which is cached on a
+        TaskRunTable so that it is shared by each of the get methods.
+        """
+        cache = getattr(task_run_df, 'cache', None)
+        if cache is not None and 'annotations' in cache:
+            return cache['annotations']
+
+        self._validate(task_run_df)
+        annotations = defaultdict(list)
+        rows = zip(task_run_df['user_id'], task_run_df['info'])
+        for user_id, task_run_annotations in rows:
+            for anno in task_run_annotations:
+                annotations[anno['motivation']].append((user_id, anno))
+
+        if cache is not None:
+            cache['annotations'] = annotations
+        return annotations
 
     def get_comments(self, task_run_df):
         """Return a list of comments."""
-        self._validate(task_run_df)
-        comments = []
-        for _index, row in task_run_df.iterrows():
-            user_id = row['user_id']
-            annotations = row['info']
-            for anno in annotations:
-                if anno['motivation'] == 'commenting':
-                    item = (user_id, anno['body']['value'])
-                    comments.append(item)
-        return comments
+        annotations = self._get_annotations(task_run_df)
+        return [(user_id, anno['body']['value'])
+                for user_id, anno in annotations['commenting']]
 
     def get_tags(self, task_run_df):
         """Return a dict of tags against fragment selectors."""
-        self._validate(task_run_df)
-        annotations = list(itertools.chain(*task_run_df['info']))
+        annotations = self._get_annotations(task_run_df)
         tags = {}
-        for anno in annotations:
-            if anno['motivation'] == 'tagging':
-                body = anno['body']
-                if isinstance(body, list):
-                    tag = [item['value'] for item in body
-                           if item['purpose'] == 'tagging'][0]
-                else:
-                    tag = body['value']
-                rect = self.get_rect_from_selection_anno(anno)
-                tag_values = tags.get(tag, [])
-                tag_values.append(rect)
-                tags[tag] = tag_values
+        for _user_id, anno in annotations['tagging']:
+            body = anno['body']
+            if isinstance(body, list):
+                tag = [item['value'] for item in body
+                       if item['purpose'] == 'tagging'][0]
+            else:
+                tag = body['value']
+            rect = self.get_rect_from_selection_anno(anno)
+            tags.setdefault(tag, []).append(rect)
         return tags
 
     def get_transcriptions_df(self, task_run_df):
         """Return a dataframe of transcriptions."""
-        self._validate(task_run_df)
-        annotations = list(itertools.chain(*task_run_df['info']))
+        annotations = self._get_annotations(task_run_df)
         transcriptions = {}
-        for anno in annotations:
-            if anno['motivation'] == 'describing':
-                tag = [body['value'] for body in anno['body']
-                       if body['purpose'] == 'tagging'][0]
-                value = [body['value'] for body in anno['body']
-                         if body['purpose'] == 'describing'][0]
-                tag_values = transcriptions.get(tag, [])
-                tag_values.append(value)
-                transcriptions[tag] = tag_values
+        for _user_id, anno in annotations['describing']:
+            tag = [body['value'] for body in anno['body']
+                   if body['purpose'] == 'tagging'][0]
+            value = [body['value'] for body in anno['body']
+                     if body['purpose'] == 'describing'][0]
+            transcriptions.setdefault(tag, []).append(value)
         return pandas.DataFrame(transcriptions)
@@ -0,0 +1,219 @@
+# -*- coding: utf8 -*-
+"""Transcription normalisation module for pybossa-lc.
+
+Normalises transcribed values according to a template's analysis rules.
+
+The rules are compiled once into a Normaliser, a chain of the steps that
+the rules enable. Each Normaliser caches its most recently normalised
+values, which are often repeated as volunteers transcribe the same names
+and dates across a volume.
+"""
+
+import re
+import json
+import string
+import datetime
+import dateutil
+import dateutil.parser
+from threading import Lock
+from titlecase import titlecase
+
+from .cache import LRUCache
+
+
+CASE = {
+    'title': lambda value: titlecase(value.lower()),
+    'lower': lambda value: value.lower(),
+    'upper': lambda value: value.upper()
+}
+
+WHITESPACE = {
+    'normalise': lambda value: " ".join(value.split()),
+    'underscore': lambda value: " ".join(value.split()).replace(' ', '_'),
+    'full_stop': lambda value: " ".join(value.split()).replace(' ', '.')
+}
+
+MONTHS = {
+    'jan': 1, 'january': 1,
+    'feb': 2, 'february': 2,
+    'mar': 3, 'march': 3,
+    'apr': 4, 'april': 4,
+    'may': 5,
+    'jun': 6, 'june': 6,
+    'jul': 7, 'july': 7,
+    'aug': 8, 'august': 8,
+    'sep': 9, 'sept': 9, 'september': 9,
+    'oct': 10, 'october': 10,
+    'nov': 11, 'november': 11,
+    'dec': 12, 'december': 12
+}
+
+_month = '(?P<month>{})'.format('|'.join(sorted(MONTHS, key=len,
+                                                reverse=True)))
+_day = r'(?P<day>\d{1,2})(?:st|nd|rd|th)?'
+_year = r'(?P<year>[12]\d{3})'
+
+ISO_DATE_RE = re.compile('^' + _year + r'(?P<sep>[/.-])(?P<a>\d{1,2})'
+                         r'(?P=sep)(?P<b>\d{1,2})$')
+NUMERIC_DATE_RE = re.compile(r'^(?P<a>\d{1,2})(?P<sep>[/.-])(?P<b>\d{1,2})'
+                             r'(?P=sep)' + _year + '$')
+DAY_MONTH_YEAR_RE = re.compile('^{0} {1},? {2}$'.format(_day, _month, _year),
+                               re.IGNORECASE)
+MONTH_DAY_YEAR_RE = re.compile('^{0} {1},? {2}$'.format(_month, _day, _year),
+                               re.IGNORECASE)
+YEAR_RE = re.compile('^' + _year + '$')
+
+#: Number of normalised values cached for each set of rules.
+CACHE_SIZE = 10000
+
+_normalisers = {}
+_normalisers_lock = Lock()
+
+
+def trim_punctuation(value):
+    """Strip punctuation from either end of a string."""
+    return value.strip(string.punctuation)
+
+
+def normalise_date(value, dayfirst=False, yearfirst=False):
+    """Return an ISO date for a date string, or '' if it is not a date.
+
+    The year is stripped if it was not given.
+    """
+    # Trim trailing whitespace
+    value = " ".join(value.split())
+
+    # Strip punctuation
+    value = value.strip(string.punctuation)
+
+    # Ensure we have at least four digits
+    if len(value) < 4:
+        return ''
+
+    ts = parse_common_date(value, dayfirst)
+    if not ts:
+        try:
+            ts = dateutil.parser.parse(value, dayfirst=dayfirst,
+                                       yearfirst=yearfirst)
+        except (ValueError, TypeError):
+            return ''
+    iso = ts.isoformat()[:10]
+
+    # Strip the year if it was not given
+    no_start_year = yearfirst and not value.startswith(str(ts.year))
+    no_end_year = not yearfirst and not value.endswith(str(ts.year))
+    if no_start_year or no_end_year:
+        iso = iso[4:]
+
+    return iso
+
+
+def parse_common_date(value, dayfirst=False):
+    """Parse the most common forms of transcribed date without dateutil.
+
+    Handles ISO dates, numeric dates ending with the year, dates with a
+    named month and bare years, giving the same results as dateutil.
+    Returns None if the value is not in one of these forms, or is ambiguous
+    in a way that should be resolved by dateutil.
+    """
+    match = ISO_DATE_RE.match(value)
+    if match:
+        year, day, month = _order_day_month(match, dayfirst)
+        return _get_date(year, month, day)
+
+    match = NUMERIC_DATE_RE.match(value)
+    if match:
+        year, day, month = _order_day_month(match, dayfirst)
+        return _get_date(year, month, day)
+
+    match = (DAY_MONTH_YEAR_RE.match(value) or
+             MONTH_DAY_YEAR_RE.match(value))
+    if match:
+        month = MONTHS[match.group('month').lower()]
+        return _get_date(match.group('year'), month, match.group('day'))
+
+    match = YEAR_RE.match(value)
+    if match:
+        today = datetime.date.today()
+        return _get_date(match.group('year'), today.month, today.day)
+
+
+def _order_day_month(match, dayfirst):
+    """Return the year, day and month of a numeric date match.
+
+    Where both numbers could be a month, the first is taken as the day if
+    dayfirst, as with dateutil. Otherwise the number that could be a month
+    is taken as the month, except for ISO dates where only the second
+    could be, which are left to dateutil by returning None for the day and
+    month.
+    """
+    year = match.group('year')
+    a = int(match.group('a'))
+    b = int(match.group('b'))
+    if a <= 12 and b <= 12:
+        return (year, a, b) if dayfirst else (year, b, a)
+    elif a <= 12:
+        return year, b, a
+    elif b <= 12 and match.re is not ISO_DATE_RE:
+        return year, a, b
+    return year, None, None
+
+
+def _get_date(year, month, day):
+    """Return a date, or None if the parts do not make a valid date."""
+    if month is None or day is None:
+        return None
+    try:
+        return datetime.date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+class Normaliser(object):
+    """A callable that normalises values according to a set of rules."""
+
+    _missing = object()
+
+    def __init__(self, rules, cache_size=CACHE_SIZE):
+        self.steps = self._compile(rules) if rules else []
+        self.cache = LRUCache(cache_size)
+
+    def _compile(self, rules):
+        """Return the normalisation steps enabled by the rules."""
+        steps = []
+        if rules.get('case') in CASE:
+            steps.append(CASE[rules['case']])
+        if rules.get('whitespace') in WHITESPACE:
+            steps.append(WHITESPACE[rules['whitespace']])
+        if rules.get('trim_punctuation'):
+            steps.append(trim_punctuation)
+        if rules.get('date_format'):
+            dayfirst = rules.get('dayfirst', False)
+            yearfirst = rules.get('yearfirst', False)
+            steps.append(lambda value: normalise_date(value, dayfirst,
+                                                      yearfirst))
+        return steps
+
+    def __call__(self, value):
+        if not self.steps or not isinstance(value, basestring):
+            return value
+
+        normalised = self.cache.get(value, self._missing)
+        if normalised is not self._missing:
+            return normalised
+
+        normalised = value
+        for step in self.steps:
+            normalised = step(normalised)
+        self.cache.set(value, normalised)
+        return normalised
+
+
+def get_normaliser(rules):
+    """Return the shared Normaliser for a set of rules."""
+    key = json.dumps(rules, sort_keys=True)
+    with _normalisers_lock:
+        normaliser = _normalisers.get(key)
+        if normaliser is None:
+            normaliser = _normalisers[key] = Normaliser(rules)
+        return normaliser
@@ -0,0 +1,139 @@
+# -*- coding: utf8 -*-
+"""Database queries module for analysis.
+
+Lightweight queries used when analysing results in bulk, where loading
+full ORM objects would be wasteful.
+"""
+
+from collections import defaultdict
+from sqlalchemy.sql import text
+
+
+def iter_empty_result_ids(project_id, batch_size=1000):
+    """Iterate over the IDs of a project's results that have no info.
+
+    The IDs are streamed in order using a server-side cursor on a separate
+    connection, so commits made while iterating do not close the cursor.
+    """
+    from pybossa.core import db
+    query = text('''SELECT id
+                 FROM result
+                 WHERE project_id=:project_id
+                 AND (info IS NULL
+                      OR info::text IN ('null', '{}', '[]', '""'))
+                 ORDER BY id''')
+    conn = db.engine.connect().execution_options(stream_results=True)
+    rows = conn.execute(query, project_id=project_id)
+    return _iter_rows(conn, rows, batch_size, lambda row: row.id)
+
+
+def get_result_task_ids(project_id):
+    """Return (result ID, task ID) tuples for a project's results."""
+    from pybossa.core import db
+    query = text('''SELECT id, task_id
+                 FROM result
+                 WHERE project_id=:project_id
+                 ORDER BY id''')
+    rows = db.session.execute(query, dict(project_id=project_id))
+    return [(row.id, row.task_id) for row in rows]
+
+
+def load_results(result_ids):
+    """Load results with their tasks and task runs.
+
+    One query is made for each of the results, tasks and task runs, rather
+    than one per result plus lazy loading of each task's task runs.
+    Returns a dict of result IDs against (result, task, task runs) tuples.
+    """
+    from pybossa.core import db
+    from pybossa.model.result import Result
+    from pybossa.model.task import Task
+    if not result_ids:
+        return {}
+
+    results = db.session.query(Result).filter(Result.id.in_(result_ids))
+    results = results.all()
+    task_ids = [result.task_id for result in results]
+    tasks = db.session.query(Task).filter(Task.id.in_(task_ids))
+    tasks = {task.id: task for task in tasks}
+    task_runs = load_task_runs(task_ids)
+    return {result.id: (result, tasks[result.task_id],
+                        task_runs[result.task_id])
+            for result in results}
+
+
+def load_task_runs(task_ids):
+    """Load the task runs for a set of tasks, ordered by ID.
+
+    Only the columns needed for analysis are selected, as rows rather than
+    ORM objects. Returns a dict of task IDs against lists of rows.
+    """
+    from pybossa.core import db
+    from pybossa.model.task_run import TaskRun
+    task_runs = defaultdict(list)
+    if not task_ids:
+        return task_runs
+
+    query = db.session.query(TaskRun.id, TaskRun.task_id, TaskRun.user_id,
+                             TaskRun.info)
+    query = query.filter(TaskRun.task_id.in_(task_ids)).order_by(TaskRun.id)
+    for row in query:
+        task_runs[row.task_id].append(row)
+    return task_runs
+
+
+def load_users(user_ids):
+    """Load the id, name and fullname of a set of users.
+
+    Returns a dict of user IDs against rows.
+    """
+    from pybossa.core import db
+    from pybossa.model.user import User
+    if not user_ids:
+        return {}
+
+    query = db.session.query(User.id, User.name, User.fullname)
+    query = query.filter(User.id.in_(user_ids))
+    return {row.id: row for row in query}
+
+
+def update_task_redundancy(task_updates):
+    """Update the state and n_answers of a set of tasks in one statement.
+
+    Each update is a dict containing the id, project_id, state and
+    n_answers of a task.
+    """
+    from pybossa.core import db
+    from pybossa.cache.projects import clean_project
+    if not task_updates:
+        return
+
+    values = []
+    params = {}
+    for i, update in enumerate(task_updates):
+        values.append('(:id{0}, :state{0}, :n_answers{0})'.format(i))
+        params['id{}'.format(i)] = update['id']
+        params['state{}'.format(i)] = update['state']
+        params['n_answers{}'.format(i)] = update['n_answers']
+    query = text('''UPDATE task
+                 SET state=v.state, n_answers=v.n_answers
+                 FROM (VALUES {}) AS v(id, state, n_answers)
+                 WHERE task.id=v.id'''.format(', '.join(values)))
+    db.session.execute(query, params)
+    db.session.commit()
+    for project_id in set(update['project_id'] for update in task_updates):
+        clean_project(project_id)
+
+
+def _iter_rows(conn, rows, batch_size, func):
+    """Yield func(row) for fetched rows, then close the connection."""
+    try:
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            for row in batch:
+                yield func(row)
+    finally:
+        rows.close()
+        conn.close()
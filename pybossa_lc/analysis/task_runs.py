@@ -0,0 +1,69 @@
+# -*- coding: utf8 -*-
+"""Task run table module for pybossa-lc.
+
+Provides a lightweight, column-oriented table of task runs for analysis.
+
+A result typically has only a handful of task runs, for which the cost of
+building a pandas DataFrame outweighs the cost of the analysis itself. The
+table supports the parts of the DataFrame interface that the analysts use
+to read columns, and can be converted to a DataFrame where one is needed.
+"""
+
+import pandas
+from pybossa.model.task_run import TaskRun
+
+
+#: The task run columns that are read for analysis.
+ANALYSIS_KEYS = ('id', 'user_id', 'info')
+
+#: Info keys that clash with task run columns, which are prefixed.
+PROTECTED_KEYS = frozenset(TaskRun.__table__.columns.keys())
+
+
+class TaskRunTable(object):
+    """A table of task runs stored as a list of values per key.
+
+    Any key that is missing from a task run is given the value None. Data
+    derived from the task runs can be stored in the cache dict, to be shared
+    by each step of the analysis of a result.
+    """
+
+    __slots__ = ('index', 'columns', 'cache')
+
+    def __init__(self, records, index=None):
+        n_records = len(records)
+        self.index = list(index) if index is not None else range(n_records)
+        self.columns = {}
+        self.cache = {}
+        for i, record in enumerate(records):
+            for key, value in record.items():
+                column = self.columns.get(key)
+                if column is None:
+                    column = self.columns[key] = [None] * n_records
+                column[i] = value
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def keys(self):
+        """Return the keys of the table."""
+        return self.columns.keys()
+
+    def get(self, key, default=None):
+        """Return the values for a key, or a default if not present."""
+        return self.columns.get(key, default)
+
+    @property
+    def empty(self):
+        """Check if the table has no task runs."""
+        return not self.index
+
+    def to_dataframe(self):
+        """Return the table as a pandas DataFrame."""
+        return pandas.DataFrame(self.columns, index=self.index)
@@ -10,10 +10,10 @@ class Z3950Analyst(BaseAnalyst):
 
     def get_comments(self, task_run_df):
         """Return a list of comments."""
-        comments = task_run_df['comments'].tolist()
-        user_ids = task_run_df['user_id'].tolist()
-        return [(user_ids[i], comment) for i, comment in enumerate(comments)
-                if comment]
+        comments = task_run_df['comments']
+        user_ids = task_run_df['user_id']
+        return [(user_id, comment)
+                for user_id, comment in zip(user_ids, comments) if comment]
 
     def get_tags(self, task_run_df):
         """Return a dict of tags against fragment selectors."""
@@ -23,7 +23,8 @@ class Z3950Analyst(BaseAnalyst):
         """Return a dataframe of transcriptions."""
         replaced_keys = dict(shelfmark='reference', oclc='control_number')
         required_keys = ['control_number', 'reference']
-        df = self.replace_df_keys(task_run_df, **replaced_keys)
+        df = self.to_dataframe(task_run_df)
+        df = self.replace_df_keys(df, **replaced_keys)
 
         if not all(key in df for key in required_keys):
             msg = 'Invalid task run data: required keys are missing'
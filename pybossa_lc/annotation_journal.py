@@ -0,0 +1,369 @@
+# -*- coding: utf8 -*-
+"""Annotation journal module for pybossa-lc.
+
+Buffers writes to the Web Annotation server in a local, append-only journal,
+so that they can be acknowledged immediately and sent in batches by a
+background flusher.
+
+Each process journals to its own subdirectory of the journal directory,
+which it holds an exclusive lock on while it is running. A subdirectory
+that can be locked by another process was left by a process that has
+exited, so its segments are claimed and sent by the next process to start.
+
+A journal is a directory of JSON lines segment files. Writes are appended
+to the open segment. To flush, the open segment is sealed and each sealed
+segment is renamed with a .flushing suffix, sent to the server in order,
+then removed. A segment that still has the .flushing suffix, after a failed
+flush or a crash, may have been partly sent, so its Annotations are only
+created where a matching Annotation does not already exist. Deletions are
+always safe to repeat.
+"""
+
+import os
+import json
+import time
+import errno
+import fcntl
+import shutil
+import tempfile
+import threading
+from collections import Counter
+
+
+SEGMENT_SUFFIX = '.jsonl'
+FLUSHING_SUFFIX = '.flushing'
+LOCK_FILENAME = 'lock'
+
+_start_lock = threading.Lock()
+
+
+class AnnotationJournal(object):
+
+    def __init__(self, client, app=None):
+        self.client = client
+        self.app = app
+        self.directory = None
+        self._pid = None
+        self._lock_file = None
+        if app is not None:  # pragma: no cover
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the extension."""
+        self.app = app
+        self.directory = app.config.get('WEB_ANNOTATION_JOURNAL_DIR')
+        self.interval = app.config.get('WEB_ANNOTATION_JOURNAL_INTERVAL', 1)
+        self.fsync = app.config.get('WEB_ANNOTATION_JOURNAL_FSYNC', True)
+        self._pid = None
+        if self.directory and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    @property
+    def enabled(self):
+        """Check if a journal directory has been configured."""
+        return bool(self.directory)
+
+    def create(self, iri, annotations):
+        """Journal a batch of Annotations to be added to a collection.
+
+        The Annotations are returned as given, without IDs.
+        """
+        if annotations:
+            self._append('create', iri, annotations)
+        return annotations
+
+    def delete(self, iri, annotations):
+        """Journal a batch of Annotations to be deleted from a collection."""
+        if annotations:
+            self._append('delete', iri, annotations)
+
+    def is_pending(self, iri, generator=None):
+        """Check if writes to a collection are waiting to be sent.
+
+        If a generator is given only writes for Annotations whose generator
+        includes each of its references are checked.
+        """
+        if not self.enabled:
+            return False
+        self._start()
+        ids = self._get_generator_ids(generator)
+        with self._lock:
+            for counts in self._pending.values():
+                for (key_iri, key_ids), n in counts.items():
+                    if n and key_iri == iri and ids <= key_ids:
+                        return True
+        return False
+
+    def flush(self):
+        """Send every journalled write to the server, in order.
+
+        Any error is raised once the segment being sent has been left to be
+        retried by the next flush.
+        """
+        if not self.enabled:
+            return
+        self._start()
+        with self._flush_lock:
+            with self._lock:
+                self._seal()
+                names = sorted(self._pending)
+            for name in names:
+                self._flush_segment(name)
+
+    def close(self):
+        """Stop the background flusher and send any remaining writes."""
+        if self._pid != os.getpid():
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+        self._release()
+        self._pid = None
+
+    def _start(self):
+        """Set up the journal for this process and start the flusher.
+
+        Segments left by processes that have exited are claimed to be sent.
+        As threads do not survive a fork, a forked process starts afresh in
+        its own subdirectory.
+        """
+        with _start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._lock_file is not None:
+                self._lock_file.close()
+            self._lock = threading.Lock()
+            self._flush_lock = threading.Lock()
+            self._segment = None
+            self._segment_name = None
+            self._n_segments = 0
+            self._pending = {}
+            self._lock_file, self._own_dir = self._make_own_dir()
+            self._claim_orphans()
+            for name in self._list_segments():
+                entries = self._read_segment(name)
+                self._pending[name] = self._count_keys(entries)
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _make_own_dir(self):
+        """Create and lock a subdirectory for this process's segments.
+
+        The subdirectory is locked before it is moved into place, so that it
+        can never be claimed by another process while it is in use. Return
+        the open lock file and the path to the subdirectory.
+        """
+        prefix = '.{}-'.format(os.getpid())
+        tmp_dir = tempfile.mkdtemp(prefix=prefix, dir=self.directory)
+        lock_file = open(os.path.join(tmp_dir, LOCK_FILENAME), 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        own_dir = os.path.join(self.directory, os.path.basename(tmp_dir)[1:])
+        os.rename(tmp_dir, own_dir)
+        return lock_file, own_dir
+
+    def _claim_orphans(self):
+        """Move segments left by processes that have exited into our own.
+
+        Subdirectories that are locked belong to running processes and are
+        left alone.
+        """
+        for filename in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, filename)
+            if filename.startswith('.') or path == self._own_dir:
+                continue
+            lock_path = os.path.join(path, LOCK_FILENAME)
+            try:
+                fd = os.open(lock_path, os.O_RDWR)
+            except OSError as err:
+                if err.errno in [errno.ENOENT, errno.ENOTDIR]:
+                    continue  # Not a journal, or claimed by another process
+                raise
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError as err:
+                    if err.errno in [errno.EAGAIN, errno.EACCES]:
+                        continue  # In use
+                    raise
+                if not os.path.exists(lock_path):
+                    continue  # Claimed by another process before we locked
+                for name in os.listdir(path):
+                    if name != LOCK_FILENAME:
+                        self._adopt(os.path.join(path, name))
+                shutil.rmtree(path)
+            finally:
+                os.close(fd)
+
+    def _adopt(self, path):
+        """Move a segment file into this process's subdirectory.
+
+        A segment with the same name as one already adopted is renamed to
+        sort just after it.
+        """
+        filename = os.path.basename(path)
+        target = os.path.join(self._own_dir, filename)
+        if os.path.exists(target):
+            stem, suffix = os.path.splitext(filename)
+            orphan = os.path.basename(os.path.dirname(path))
+            target = os.path.join(self._own_dir, '{0}-{1}{2}'.format(
+                stem, orphan, suffix))
+        os.rename(path, target)
+
+    def _release(self):
+        """Remove this process's subdirectory if empty, then unlock it."""
+        with self._lock:
+            if not self._pending:
+                shutil.rmtree(self._own_dir)
+        self._lock_file.close()
+        self._lock_file = None
+
+    def _run(self):
+        """Flush the journal every interval until stopped."""
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as err:
+                msg = 'Failed to flush the annotation journal: {}'
+                self.app.logger.error(msg.format(err))
+
+    def _append(self, op, iri, annotations):
+        """Append an entry to the open segment."""
+        self._start()
+        entry = dict(op=op, collection=iri, annotations=annotations)
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            if self._segment is None:
+                self._open_segment()
+            self._segment.write(line)
+            self._segment.flush()
+            if self.fsync:
+                os.fsync(self._segment.fileno())
+            self._pending[self._segment_name].update(
+                self._count_keys([entry]))
+
+    def _open_segment(self):
+        """Open a new segment, named to sort after any existing segment."""
+        self._n_segments += 1
+        name = '{0:015d}-{1:06d}'.format(int(time.time() * 1000),
+                                         self._n_segments)
+        self._segment = open(self._get_path(name), 'a')
+        self._segment_name = name
+        self._pending[name] = Counter()
+
+    def _seal(self):
+        """Close the open segment, so that new writes start another."""
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+            self._segment_name = None
+
+    def _flush_segment(self, name):
+        """Send the writes in a sealed segment to the server, then remove it.
+
+        A segment that has been partly sent is reconciled with the server.
+        """
+        path = self._get_path(name)
+        flushing_path = self._get_path(name, FLUSHING_SUFFIX)
+        reconcile = not os.path.exists(path)
+        if not reconcile:
+            os.rename(path, flushing_path)
+
+        for op, iri, annotations in self._group(self._read_segment(name)):
+            if op == 'create':
+                if reconcile:
+                    annotations = self._get_missing(iri, annotations)
+                self.client.create_batch(iri, annotations)
+            else:
+                self.client.delete_batch(annotations)
+
+        os.remove(flushing_path)
+        with self._lock:
+            del self._pending[name]
+
+    def _get_missing(self, iri, annotations):
+        """Return the Annotations that do not already exist on the server.
+
+        An existing Annotation matches if it has each of the values given in
+        a journalled Annotation, and can only match one.
+        """
+        existing = {}
+        missing = []
+        for anno in annotations:
+            generator = anno.get('generator')
+            key = json.dumps(generator, sort_keys=True)
+            if key not in existing:
+                contains = {'generator': generator}
+                existing[key] = (self.client.search_annotations(iri, contains)
+                                 if generator else [])
+            candidates = existing[key]
+            for i, other in enumerate(candidates):
+                if all(other.get(k) == v for k, v in anno.items()):
+                    del candidates[i]
+                    break
+            else:
+                missing.append(anno)
+        return missing
+
+    def _group(self, entries):
+        """Merge consecutive entries with the same operation and collection.
+
+        Return a list of tuples of an operation, collection and Annotations.
+        """
+        groups = []
+        for entry in entries:
+            op = entry['op']
+            iri = entry['collection']
+            if groups and groups[-1][:2] == (op, iri):
+                groups[-1][2].extend(entry['annotations'])
+            else:
+                groups.append((op, iri, list(entry['annotations'])))
+        return groups
+
+    def _count_keys(self, entries):
+        """Count the Annotations in entries by collection and generator."""
+        counts = Counter()
+        for entry in entries:
+            for anno in entry['annotations']:
+                ids = self._get_generator_ids(anno.get('generator'))
+                counts[(entry['collection'], ids)] += 1
+        return counts
+
+    def _get_generator_ids(self, generator):
+        """Return the IDs referenced by an Annotation generator."""
+        if isinstance(generator, dict):
+            generator = [generator]
+        return frozenset(ref.get('id') for ref in generator or []
+                         if isinstance(ref, dict))
+
+    def _list_segments(self):
+        """Return the names of any segments in this process's subdirectory."""
+        names = set()
+        for filename in os.listdir(self._own_dir):
+            for suffix in [SEGMENT_SUFFIX, FLUSHING_SUFFIX]:
+                if filename.endswith(suffix):
+                    names.add(filename[:-len(suffix)])
+        return sorted(names)
+
+    def _read_segment(self, name):
+        """Return the entries in a segment.
+
+        A line left incomplete by a crash while it was being written is
+        ignored, as that write was never acknowledged.
+        """
+        path = self._get_path(name)
+        if not os.path.exists(path):
+            path = self._get_path(name, FLUSHING_SUFFIX)
+        entries = []
+        with open(path) as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    break
+                entries.append(json.loads(line))
+        return entries
+
+    def _get_path(self, name, suffix=SEGMENT_SUFFIX):
+        """Return the path to a segment file."""
+        return os.path.join(self._own_dir, name + suffix)
@@ -104,7 +104,10 @@ def get_template_framework():
         'date_format': False,
         'dayfirst': False,
         'year_first': False,
-        'remove_fragment_selector': False
+        'remove_fragment_selector': False,
+        'consensus': '',  # exact, edit_distance or token_set (if any)
+        'max_distance': 1,  # for edit_distance consensus
+        'min_similarity': 0.8  # for token_set consensus
     }
 
     z3950_databases = current_app.config.get('Z3950_DATABASES', {}).keys()
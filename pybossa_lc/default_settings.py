@@ -5,3 +5,49 @@ GITHUB_REPO = 'https://github.com/LibCrowds/libcrowds'
 
 # Email all comment annotations to administrators
 EMAIL_COMMENT_ANNOTATIONS = False
+
+# Maximum number of Annotations sent to the Web Annotation server per batch
+WEB_ANNOTATION_BATCH_SIZE = 100
+
+# Maximum number of concurrent requests made to the Web Annotation server
+WEB_ANNOTATION_MAX_WORKERS = 8
+
+# Connection pool size for the Web Annotation server
+WEB_ANNOTATION_POOL_SIZE = 10
+
+# Maximum number of requests in flight from the asynchronous client
+WEB_ANNOTATION_MAX_IN_FLIGHT = 64
+
+# Connect and read timeouts, in seconds, for the Web Annotation server
+WEB_ANNOTATION_TIMEOUT = (5, 60)
+
+# Retry policy for failed requests to the Web Annotation server
+WEB_ANNOTATION_MAX_RETRIES = 3
+WEB_ANNOTATION_BACKOFF = 0.5
+
+# Number of Annotations per page of Web Annotation server search results
+WEB_ANNOTATION_PAGE_SIZE = 100
+
+# Seconds for which a validated AnnotationCollection IRI is trusted
+WEB_ANNOTATION_COLLECTION_TTL = 300
+
+# Directory of a local journal that writes to the Web Annotation server are
+# buffered in, or None to send writes immediately
+WEB_ANNOTATION_JOURNAL_DIR = None
+
+# Seconds between flushes of the journal
+WEB_ANNOTATION_JOURNAL_INTERVAL = 1
+
+# Sync each journalled write to disk; disabling this trades durability for
+# speed
+WEB_ANNOTATION_JOURNAL_FSYNC = True
+
+# Number of results analysed per chunk when analysing a whole project
+ANALYSIS_CHUNK_SIZE = 100
+
+# Replace every Annotation when re-analysing a result, rather than only
+# deleting and adding those that have changed
+ANALYSIS_REPLACE_ANNOTATIONS = False
+
+# Number of chunks of results analysed concurrently
+ANALYSIS_WORKERS = 4
@@ -1,10 +1,16 @@
 # -*- coding: utf8 -*-
 
-from .web_annotation_client import WebAnnotationClient
+from .web_annotation_client import (WebAnnotationClient,
+                                    AsyncWebAnnotationClient)
+from .annotation_journal import AnnotationJournal
 
 
-__all__ = ['wa_client']
+__all__ = ['wa_client', 'async_wa_client', 'annotation_journal']
 
 
 # Web Annotation Client
 wa_client = WebAnnotationClient()
+async_wa_client = AsyncWebAnnotationClient()
+
+# Write-behind journal for the Web Annotation server
+annotation_journal = AnnotationJournal(wa_client)
@@ -38,8 +38,8 @@ class BulkTaskIIIFEnhancedImporter(BulkTaskIIIFImporter):
         results = result_repo.filter_by(project_id=parent_id)
         for result in results:
             self._validate_parent_result(result)
-            parent_annotations = [a for a in rc.get_by_task_id(result.task_id)
-                                  if a['motivation'] != 'commenting']
+            parent_annotations = (a for a in rc.iter_by_task_id(result.task_id)
+                                  if a['motivation'] != 'commenting')
             for anno in parent_annotations:
                 source = self._get_source(anno)
                 data = indexed_task_data.get(source)
@@ -2,66 +2,175 @@
 # -*- coding: utf8 -*-
 """Base model."""
 
-from flask import url_for, current_app
+import time
+from threading import Lock
+from flask import url_for, current_app, g
 
-from .. import wa_client
+from .. import wa_client, async_wa_client, annotation_journal
+
+
+# Collection IRIs validated by this process, against the time of validation
+_validated_iris = {}
+_validated_iris_lock = Lock()
+
+
+def invalidate_collection_cache(iri=None):
+    """Forget that a Collection IRI, or all Collection IRIs, were valid."""
+    with _validated_iris_lock:
+        if iri is None:
+            _validated_iris.clear()
+        else:
+            _validated_iris.pop(iri, None)
+
+
+def get_reference_bases():
+    """Return the values used to build Annotation generators and creators.
+
+    The URL bases are resolved once per app context.
+    """
+    bases = getattr(g, '_lc_reference_bases', None)
+    if bases is None:
+        task_url_base = url_for('api.api_task', _external=True).rstrip('/')
+        user_url_base = url_for('api.api_user', _external=True).rstrip('/')
+        bases = {
+            'software': {
+                "id": current_app.config.get('GITHUB_REPO'),
+                "type": "Software",
+                "name": "LibCrowds",
+                "homepage": current_app.config.get('SPA_SERVER_NAME')
+            },
+            'task': task_url_base + '/{}',
+            'user': user_url_base + '/{}'
+        }
+        g._lc_reference_bases = bases
+    return bases
 
 
 class Base(object):
     """Base model.
 
     Works as a client for an AnnotationCollection stored on the server.
+
+    The Collection IRI is checked on initialisation or, if lazy is True,
+    before the first request that uses it.
+
+    If write_behind is True new and deleted Annotations are written to the
+    annotation journal, to be sent to the server in the background. Any
+    journalled writes are sent before searching for Annotations they could
+    affect.
     """
 
-    def __init__(self, iri):
+    def __init__(self, iri, lazy=False, write_behind=False):
+        if write_behind and not annotation_journal.enabled:
+            raise ValueError('WEB_ANNOTATION_JOURNAL_DIR is not set')
         self.iri = iri
-        self._check_iri()
+        self.write_behind = write_behind
+        self._iri_checked = False
+        if not lazy:
+            self._check_iri()
 
     def _check_iri(self):
         """Check the Collection IRI is valid.
 
         The client should raise a requests.exceptions.HTTPError if not.
+        Valid IRIs are cached for WEB_ANNOTATION_COLLECTION_TTL seconds.
         """
-        wa_client.get_collection(self.iri, minimal=True)
+        ttl = current_app.config.get('WEB_ANNOTATION_COLLECTION_TTL', 300)
+        now = time.time()
+        with _validated_iris_lock:
+            validated_at = _validated_iris.get(self.iri)
+        if validated_at is None or now - validated_at > ttl:
+            wa_client.get_collection(self.iri, minimal=True)
+            with _validated_iris_lock:
+                _validated_iris[self.iri] = now
+        self._iri_checked = True
+
+    def _ensure_iri_checked(self):
+        """Check the Collection IRI if that was deferred."""
+        if not self._iri_checked:
+            self._check_iri()
 
     def _get_generator(self, task_id):
         """Return a reference to the LibCrowds software."""
-        spa_server_name = current_app.config.get('SPA_SERVER_NAME')
-        github_repo = current_app.config.get('GITHUB_REPO')
-        task_url_base = url_for('api.api_task', _external=True).rstrip('/')
+        bases = get_reference_bases()
         return [
+            dict(bases['software']),
             {
-                "id": github_repo,
-                "type": "Software",
-                "name": "LibCrowds",
-                "homepage": spa_server_name
-            },
-            {
-                "id": "{}/{}".format(task_url_base, task_id),
+                "id": bases['task'].format(task_id),
                 "type": "Software"
             }
         ]
 
     def _get_creator(self, user):
         """Return a reference to a LibCrowds user."""
-        user_url_base = url_for('api.api_user', _external=True).rstrip('/')
+        bases = get_reference_bases()
         return {
-            "id": "{}/{}".format(user_url_base, user.id),
+            "id": bases['user'].format(user.id),
             "type": "Person",
             "name": user.fullname,
             "nickname": user.name
         }
 
+    def _get_total(self):
+        """Return the number of Annotations in the collection."""
+        self._ensure_iri_checked()
+        collection = wa_client.get_collection(self.iri, minimal=True)
+        return int(collection.get('total', 0))
+
     def _create_annotation(self, anno):
         """Create an Annotation."""
+        self._ensure_iri_checked()
+        if self.write_behind:
+            return annotation_journal.create(self.iri, [anno])[0]
         anno = wa_client.create_annotation(self.iri, anno)
         return anno
 
+    def _create_batch(self, annotations):
+        """Create a batch of Annotations."""
+        self._ensure_iri_checked()
+        if self.write_behind:
+            return annotation_journal.create(self.iri, annotations)
+        return wa_client.create_batch(self.iri, annotations)
+
     def _search_annotations(self, contains):
         """Get a set of annotations by contents."""
+        self._ensure_iri_checked()
+        self._flush_pending(contains)
         annotations = wa_client.search_annotations(self.iri, contains)
         return annotations
 
+    def _search_annotations_async(self, contains):
+        """Search for annotations by contents in the background.
+
+        Returns an AsyncResult for the annotations.
+        """
+        self._ensure_iri_checked()
+        self._flush_pending(contains)
+        return async_wa_client.search_annotations(self.iri, contains)
+
+    def _iter_search_annotations(self, contains, prefetch=False):
+        """Iterate over a set of annotations by contents."""
+        self._ensure_iri_checked()
+        self._flush_pending(contains)
+        return wa_client.iter_search_annotations(self.iri, contains,
+                                                 prefetch=prefetch)
+
     def _delete_batch(self, annotations):
         """Delete a batch of Annotations."""
+        if self.write_behind:
+            annotation_journal.delete(self.iri, annotations)
+            return
         wa_client.delete_batch(annotations)
+
+    def _flush_pending(self, contains):
+        """Send journalled writes that could affect a search."""
+        if not self.write_behind:
+            return
+        generator = contains.get('generator')
+        if annotation_journal.is_pending(self.iri, generator):
+            annotation_journal.flush()
+
+    def flush(self):
+        """Send any journalled writes to the server."""
+        if self.write_behind:
+            annotation_journal.flush()
@@ -1,49 +1,115 @@
 # -*- coding: utf8 -*-
 """ResultCollection model."""
 
-from flask import url_for
+import re
+from flask import url_for, current_app
 
 from .base import Base
+from ..web_annotation_client import gather
 
 
 class ResultCollection(Base):
     """ResultCollection model."""
 
-    def __init__(self, iri):
-        super(ResultCollection, self).__init__(iri)
+    def __init__(self, iri, lazy=False, write_behind=False):
+        super(ResultCollection, self).__init__(iri, lazy, write_behind)
 
     def add_comment(self, task, target, value, user=None):
         """Add a commenting Annotation."""
-        self._validate_required_values(target=target, value=value)
-        anno = self._get_commenting_annotation(task, target, value, user)
+        anno = self.new_comment(task, target, value, user)
         anno = self._create_annotation(anno)
         return anno
 
     def add_transcription(self, task, target, value, tag):
         """Add a describing Annotation."""
-        self._validate_required_values(target=target, value=value, tag=tag)
-        anno = self._get_describing_annotation(task, target, value, tag)
+        anno = self.new_transcription(task, target, value, tag)
         anno = self._create_annotation(anno)
         return anno
 
     def add_tag(self, task, target, value, rect=None):
         """Add a tagging Annotation."""
-        self._validate_required_values(target=target, value=value)
-        anno = self._get_tagging_annotation(task, target, value, rect)
+        anno = self.new_tag(task, target, value, rect)
         anno = self._create_annotation(anno)
         return anno
 
+    def add_batch(self, annotations):
+        """Add a batch of Annotations."""
+        return self._create_batch(annotations)
+
+    def new_comment(self, task, target, value, user=None, creator=None):
+        """Return a new commenting Annotation, without adding it.
+
+        The creator may be given in place of the user, if already known.
+        """
+        self._validate_required_values(target=target, value=value)
+        return self._get_commenting_annotation(task, target, value, user,
+                                               creator)
+
+    def new_transcription(self, task, target, value, tag):
+        """Return a new describing Annotation, without adding it."""
+        self._validate_required_values(target=target, value=value, tag=tag)
+        return self._get_describing_annotation(task, target, value, tag)
+
+    def new_tag(self, task, target, value, rect=None):
+        """Return a new tagging Annotation, without adding it."""
+        self._validate_required_values(target=target, value=value)
+        return self._get_tagging_annotation(task, target, value, rect)
+
     def get_by_task_id(self, task_id):
         """Return current Annotations for a task."""
+        return list(self.iter_by_task_id(task_id))
+
+    def iter_by_task_id(self, task_id):
+        """Iterate over current Annotations for a task."""
         contains = {
             'generator': self._get_generator(task_id)
         }
-        return self._search_annotations(contains)
+        return self._iter_search_annotations(contains)
+
+    def get_by_task_ids(self, task_ids):
+        """Return current Annotations for a set of tasks, indexed by task ID.
+
+        All LibCrowds Annotations in the collection are fetched in a single
+        paginated search, rather than searching once per task. The collection
+        is shared by every project in a category, so where there are fewer
+        tasks than pages in the collection each task is searched for instead,
+        with the searches pipelined by the asynchronous client.
+        """
+        page_size = current_app.config.get('WEB_ANNOTATION_PAGE_SIZE', 100)
+        n_pages = self._get_total() / float(page_size)
+        if len(task_ids) < n_pages:
+            searches = [self._search_annotations_async({
+                'generator': self._get_generator(task_id)
+            }) for task_id in task_ids]
+            return dict(zip(task_ids, gather(searches)))
+
+        index = {task_id: [] for task_id in task_ids}
+        task_path = url_for('api.api_task').rstrip('/')
+        task_id_re = re.compile(r'{}/(\d+)$'.format(re.escape(task_path)))
+        contains = {
+            'generator': self._get_generator(None)[:1]
+        }
+        for anno in self._iter_search_annotations(contains, prefetch=True):
+            task_id = self._get_task_id(anno, task_id_re)
+            if task_id in index:
+                index[task_id].append(anno)
+        return index
 
     def delete_batch(self, annotations):
         """Delete a batch of Annotations."""
         return self._delete_batch(annotations)
 
+    def _get_task_id(self, anno, task_id_re):
+        """Return the ID of the task that generated an Annotation."""
+        generator = anno.get('generator', [])
+        if isinstance(generator, dict):
+            generator = [generator]
+        for software in generator:
+            match = task_id_re.search(software.get('id', ''))
+            if match:
+                return int(match.group(1))
+        return None
+
     def _validate_required_values(self, **kwargs):
         """Verify that the given values exist."""
         for k, v in kwargs.items():
@@ -62,7 +128,8 @@ class ResultCollection(Base):
             base['partOf'] = task.info['manifest']
         return base
 
-    def _get_commenting_annotation(self, task, target, value, user):
+    def _get_commenting_annotation(self, task, target, value, user,
+                                   creator=None):
         """Return a commenting Annotation."""
         anno = self._get_annotation_base(task, 'commenting')
         anno['target'] = target
@@ -72,8 +139,10 @@ class ResultCollection(Base):
             "purpose": "commenting",
             "format": "text/plain"
         }
-        if user:
-            anno['creator'] = self._get_creator(user)
+        if user and not creator:
+            creator = self._get_creator(user)
+        if creator:
+            anno['creator'] = creator
         return anno
 
     def _get_describing_annotation(self, task, target, value, tag):
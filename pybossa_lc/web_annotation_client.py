@@ -3,6 +3,19 @@
 
 import json
 import requests
+from threading import Lock
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+class BatchError(requests.exceptions.RequestException):
+    """Raised when requests for some items in a batch fail."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        msg = '{0} requests in the batch failed'.format(len(errors))
+        super(BatchError, self).__init__(msg)
 
 
 class WebAnnotationClient(object):
@@ -12,33 +25,183 @@ class WebAnnotationClient(object):
         if app is not None:  # pragma: no cover
             self.init_app(app)
 
-    def init_app(self, app):
-        """Configure the extension."""
+    def init_app(self, app, pool_block=False):
+        """Configure the extension.
+
+        If pool_block is True requests wait for a free pooled connection.
+        """
         self.app = app
         self.base_url = app.config['WEB_ANNOTATION_BASE_URL']
         self.default_headers = app.config.get('WEB_ANNOTATION_HEADERS', {
             'Accept': ('application/ld+json; '
                        'profile="http://www.w3.org/ns/anno.jsonld"')
         })
+        self.batch_size = app.config.get('WEB_ANNOTATION_BATCH_SIZE', 100)
+        self.max_workers = app.config.get('WEB_ANNOTATION_MAX_WORKERS', 8)
+        self.timeout = app.config.get('WEB_ANNOTATION_TIMEOUT', (5, 60))
+        self.session = self._get_session(app.config, pool_block)
+        self._batch_create_supported = None
+        self._batch_delete_supported = None
+
+    def _get_session(self, config, pool_block=False):
+        """Return a pooled session that retries failed requests.
+
+        Only idempotent requests are retried after a response is received.
+        If pool_block is True requests wait for a free connection rather than
+        opening connections beyond the size of the pool.
+        """
+        retry = Retry(total=config.get('WEB_ANNOTATION_MAX_RETRIES', 3),
+                      backoff_factor=config.get('WEB_ANNOTATION_BACKOFF', 0.5),
+                      status_forcelist=[500, 502, 503, 504],
+                      raise_on_status=False)
+        pool_size = config.get('WEB_ANNOTATION_POOL_SIZE', 10)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=retry,
+                              pool_block=pool_block)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def get_collection(self, iri, minimal=False, iris=False):
         """Get an AnnotationCollection."""
         headers = {'Prefer': self._get_prefer_headers(minimal, iris)}
-        response = requests.get(iri, headers=headers)
+        response = self.session.get(iri, headers=headers,
+                                    timeout=self.timeout)
         response.raise_for_status()
         return response.json()
 
     def create_annotation(self, iri, annotation):
         """Add an Annotation."""
-        response = requests.post(iri, json=annotation)
+        response = self.session.post(iri, json=annotation,
+                                     timeout=self.timeout)
         response.raise_for_status()
         return response.json()
 
+    def create_batch(self, iri, annotations):
+        """Add a batch of Annotations.
+
+        The server's batch endpoint is used where available, otherwise we
+        fall back to sending chunks of concurrent single requests.
+        """
+        if not annotations:
+            return []
+
+        if self._batch_create_supported is not False:
+            created = self._post_batch(iri, annotations)
+            if created is not None:
+                return created
+
+        def create(anno):
+            return self.create_annotation(iri, anno)
+        return self._map_concurrent(create, annotations)
+
     def delete_batch(self, annotations):
-        """Delete a batch of Annotations."""
-        for anno in annotations:
-            response = requests.delete(anno['id'])
+        """Delete a batch of Annotations.
+
+        The server's batch endpoint is used where available, otherwise the
+        Annotations are deleted concurrently. Every deletion is attempted
+        before any failures are raised together as a BatchError.
+        """
+        if not annotations:
+            return
+
+        if self._batch_delete_supported is not False:
+            annotations = self._delete_batch(annotations)
+            if not annotations:
+                return
+
+        errors = []
+
+        def delete(anno):
+            try:
+                response = self.session.delete(anno['id'],
+                                               timeout=self.timeout)
+                if response.status_code != 404:  # Already deleted
+                    response.raise_for_status()
+            except requests.exceptions.RequestException as err:
+                errors.append((anno, err))
+
+        self._map_concurrent(delete, annotations)
+        if errors:
+            raise BatchError(errors)
+
+    def _post_batch(self, iri, annotations):
+        """POST chunks of Annotations to the batch endpoint.
+
+        Return None if the server does not provide a batch endpoint.
+        """
+        endpoint = self.base_url.rstrip('/') + '/batch/'
+        created = []
+        for i in range(0, len(annotations), self.batch_size):
+            chunk = annotations[i:i + self.batch_size]
+            response = self.session.post(endpoint,
+                                         params={'collection': iri},
+                                         json=chunk, timeout=self.timeout)
+            if self._is_batch_unsupported(response):
+                self._batch_create_supported = False
+                return None
+            response.raise_for_status()
+            self._batch_create_supported = True
+            created.extend(response.json())
+        return created
+
+    def _delete_batch(self, annotations):
+        """DELETE chunks of Annotations via the batch endpoint.
+
+        Return the Annotations that still need to be deleted one at a time.
+        That is every Annotation if the server does not provide a batch
+        endpoint, or the chunks that failed as some of their Annotations
+        were not found.
+        """
+        endpoint = self.base_url.rstrip('/') + '/batch/'
+        remaining = []
+        for i in range(0, len(annotations), self.batch_size):
+            chunk = annotations[i:i + self.batch_size]
+            response = self.session.delete(endpoint, json=chunk,
+                                           timeout=self.timeout)
+            if self._has_item_errors(response):
+                self._batch_delete_supported = True
+                remaining.extend(chunk)
+                continue
+            if self._is_batch_unsupported(response):
+                self._batch_delete_supported = False
+                return remaining + annotations[i:]
             response.raise_for_status()
+            self._batch_delete_supported = True
+        return remaining
+
+    def _is_batch_unsupported(self, response):
+        """Check if a batch request failed as there is no batch endpoint."""
+        return response.status_code in [404, 405, 501]
+
+    def _has_item_errors(self, response):
+        """Check if a batch request failed as some items were not found.
+
+        The server lists the items that failed in an errors array. Any other
+        404 means that the batch endpoint itself was not found.
+        """
+        if response.status_code != 404:
+            return False
+        try:
+            data = response.json()
+        except ValueError:
+            return False
+        return isinstance(data, dict) and isinstance(data.get('errors'), list)
+
+    def _map_concurrent(self, func, items):
+        """Apply func to each item using a bounded pool of threads."""
+        results = []
+        for i in range(0, len(items), self.batch_size):
+            chunk = items[i:i + self.batch_size]
+            pool = ThreadPool(min(self.max_workers, len(chunk)))
+            try:
+                results.extend(pool.map(func, chunk))
+            finally:
+                pool.close()
+                pool.join()
+        return results
 
     def _get_prefer_headers(self, minimal=False, iris=False):
         """Return the Prefer header for given container preferences."""
@@ -51,6 +214,15 @@ class WebAnnotationClient(object):
 
     def search_annotations(self, collectionIri, contains):
         """Search for Annotations with the given content."""
+        return list(self.iter_search_annotations(collectionIri, contains))
+
+    def iter_search_annotations(self, collectionIri, contains,
+                                prefetch=False):
+        """Iterate over Annotations with the given content, page by page.
+
+        If prefetch is True the next page is requested in the background
+        while the items of the current page are being consumed.
+        """
         endpoint = self.base_url.rstrip('/') + '/search/'
         params = {
             'collection': collectionIri,
@@ -59,27 +231,136 @@ class WebAnnotationClient(object):
         headers = {
             'Prefer': self._get_prefer_headers(minimal=True)
         }
-        response = requests.get(endpoint, params=params, headers=headers)
+        response = self.session.get(endpoint, params=params, headers=headers,
+                                    timeout=self.timeout)
         response.raise_for_status()
 
         data = response.json()
         if data['total'] == 0:
-            return []
+            return
 
-        annotations = []
+        pool = ThreadPool(1) if prefetch else None
+        try:
+            page = self._get_page(data['first'])
+            while page:
+                _next = page.get('next')
+                if _next and pool:
+                    next_page = pool.apply_async(self._get_page, (_next,))
+                for item in page['items']:
+                    yield item
+                if not _next:
+                    break
+                page = next_page.get() if pool else self._get_page(_next)
+        finally:
+            if pool:
+                pool.terminate()
 
-        def add_page_items(pageIri):
-            r = requests.get(pageIri)
-            if r.status_code == 404:  # pragma: no cover
-                return
-            elif r.status_code != 200:  # pragma: no cover
-                r.raise_for_status()
-            data = r.json()
-            annotations.extend(data['items'])
-            _next = data.get('next')
-            if _next:
-                add_page_items(_next)
-
-        first = data['first']
-        add_page_items(first)
-        return annotations
+    def _get_page(self, pageIri):
+        """Return an AnnotationPage, or None if it does not exist."""
+        r = self.session.get(pageIri, timeout=self.timeout)
+        if r.status_code == 404:  # pragma: no cover
+            return None
+        elif r.status_code != 200:  # pragma: no cover
+            r.raise_for_status()
+        return r.json()
+
+
+class AsyncWebAnnotationClient(object):
+    """A Web Annotation client that makes requests in the background.
+
+    Each operation returns immediately with a
+    :class:`multiprocessing.pool.AsyncResult`, whose ``get()`` method waits
+    for and returns the response, or raises any error. Up to
+    ``WEB_ANNOTATION_MAX_IN_FLIGHT`` requests are in flight at once, sharing
+    a connection pool of ``WEB_ANNOTATION_POOL_SIZE`` connections that
+    requests wait for rather than opening new connections.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.client = None
+        self._pool = None
+        self._pool_lock = Lock()
+        if app is not None:  # pragma: no cover
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configure the extension."""
+        self.close()
+        if self.client is not None:
+            self.client.session.close()
+        self.app = app
+        self.max_in_flight = app.config.get('WEB_ANNOTATION_MAX_IN_FLIGHT',
+                                            64)
+        self.client = WebAnnotationClient()
+        self.client.init_app(app, pool_block=True)
+
+    def _get_pool(self):
+        """Return the pool of threads that make requests, creating it once."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_in_flight)
+            return self._pool
+
+    def _submit(self, func, *args):
+        """Call func in the background and return an AsyncResult."""
+        return self._get_pool().apply_async(func, args)
+
+    def close(self):
+        """Wait for requests in flight, then stop the pool of threads."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
+            self.client.session.close()
+
+    def get_collection(self, iri, minimal=False, iris=False):
+        """Get an AnnotationCollection in the background."""
+        return self._submit(self.client.get_collection, iri, minimal, iris)
+
+    def create_annotation(self, iri, annotation):
+        """Add an Annotation in the background."""
+        return self._submit(self.client.create_annotation, iri, annotation)
+
+    def create_batch(self, iri, annotations):
+        """Add a batch of Annotations in the background."""
+        return self._submit(self.client.create_batch, iri, annotations)
+
+    def delete_batch(self, annotations):
+        """Delete a batch of Annotations in the background."""
+        return self._submit(self.client.delete_batch, annotations)
+
+    def search_annotations(self, collectionIri, contains):
+        """Search for Annotations with the given content in the background."""
+        return self._submit(self.client.search_annotations, collectionIri,
+                            contains)
+
+
+def wait_for(result):
+    """Return the value of an AsyncResult once it is ready.
+
+    The result is waited for in short intervals, as an untimed wait cannot be
+    interrupted by signals such as a job timeout.
+    """
+    while not result.ready():
+        result.wait(1)
+    return result.get()
+
+
+def gather(results):
+    """Wait for a list of AsyncResults and return their values in order.
+
+    Every request is waited for before the first error, if any, is raised.
+    """
+    values = []
+    error = None
+    for result in results:
+        try:
+            values.append(wait_for(result))
+        except Exception as err:
+            values.append(None)
+            error = error or err
+    if error is not None:
+        raise error
+    return values
@@ -0,0 +1,129 @@
+# -*- coding: utf8 -*-
+"""A local stand-in for a Web Annotation server."""
+
+import json
+import time
+import threading
+import urlparse
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+
+class AnnotationServer(ThreadingMixIn, HTTPServer):
+    """An in-memory Web Annotation server, run in a background thread.
+
+    Provides AnnotationCollections, single Annotations and search, but no
+    batch endpoint. Each request waits for delay seconds, so that the
+    greatest number of requests handled at once can be recorded.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, delay=0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), AnnotationHandler)
+        self.base_url = 'http://127.0.0.1:{}/annotations/'.format(
+            self.server_address[1])
+        self.delay = delay
+        self.annotations = {}
+        self.n_created = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def collection_iri(self, name):
+        return self.base_url + name + '/'
+
+    def add(self, collection_iri, annotation):
+        with self.lock:
+            self.n_created += 1
+            iri = '{0}{1}'.format(collection_iri, self.n_created)
+            annotation = dict(annotation, id=iri)
+            self.annotations[iri] = annotation
+        return annotation
+
+    def search(self, collection_iri, contains):
+        return [anno for iri, anno in sorted(self.annotations.items())
+                if iri.startswith(collection_iri) and
+                all(anno.get(k) == v for k, v in contains.items())]
+
+
+class AnnotationHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _begin(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight,
+                                       server.in_flight)
+        time.sleep(server.delay)
+
+    def do_GET(self):
+        self._begin()
+        url = urlparse.urlparse(self.path)
+        iri = self.server.base_url.rstrip('/') + url.path.replace(
+            '/annotations', '', 1)
+        query = dict(urlparse.parse_qsl(url.query))
+        if url.path.endswith('/search/'):
+            items = self._search(query)
+            page = iri + 'page/?' + url.query if items else None
+            self._respond(200, {'total': len(items), 'first': page})
+        elif url.path.endswith('/search/page/'):
+            self._respond(200, {'items': self._search(query)})
+        elif iri in self.server.annotations:
+            self._respond(200, self.server.annotations[iri])
+        else:
+            items = [anno for key, anno in self.server.annotations.items()
+                     if key.startswith(iri)]
+            self._respond(200, {'id': iri, 'type': 'AnnotationCollection',
+                                'total': len(items)})
+
+    def do_POST(self):
+        self._begin()
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.getheader('content-length', 0))
+        annotation = json.loads(self.rfile.read(length))
+        if url.path.endswith('/batch/'):
+            return self._respond(404, {})
+        iri = self.server.base_url.rstrip('/') + url.path.replace(
+            '/annotations', '', 1)
+        self._respond(201, self.server.add(iri, annotation))
+
+    def do_DELETE(self):
+        self._begin()
+        url = urlparse.urlparse(self.path)
+        length = int(self.headers.getheader('content-length', 0))
+        self.rfile.read(length)
+        iri = self.server.base_url.rstrip('/') + url.path.replace(
+            '/annotations', '', 1)
+        with self.server.lock:
+            deleted = self.server.annotations.pop(iri, None)
+        self._respond(204 if deleted else 404, None)
+
+    def _search(self, query):
+        return self.server.search(query['collection'],
+                                  json.loads(query['contains']))
+
+    def _respond(self, status, data):
+        body = json.dumps(data) if data is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/ld+json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.server.lock:
+            self.server.in_flight -= 1
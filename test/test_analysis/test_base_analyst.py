@@ -8,6 +8,7 @@ from mock import patch, call, MagicMock
 from factories import TaskFactory, TaskRunFactory, ProjectFactory, UserFactory
 from factories import CategoryFactory
 from default import db, Test, with_context, flask_app
+from flask import url_for
 from nose.tools import *
 from pybossa.core import result_repo, task_repo
 from pybossa.repositories import ResultRepository, TaskRepository
@@ -32,36 +33,168 @@ class TestBaseAnalyst(Test):
         assert_dict_equal.__self__.maxDiff = None
         assert_equal.__self__.maxDiff = None
 
+    def create_project_results(self, n_results):
+        """Create a project with a set of analysable results."""
+        task = self.ctx.create_task(1)
+        tasks = [task] + TaskFactory.create_batch(n_results - 1,
+                                                  project=task.project,
+                                                  n_answers=1)
+        for t in tasks:
+            TaskRunFactory.create(task=t)
+        results = self.result_repo.filter_by(project_id=task.project_id)
+        return task.project_id, sorted(results, key=lambda r: r.id)
+
     @with_context
-    @patch("pybossa_lc.analysis.base.BaseAnalyst.analyse")
-    def test_analyse_all(self, mock_analyse):
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_all(self, mock_analyse_result, mock_client):
         """Test that all results are analysed."""
-        project = ProjectFactory()
-        tasks = TaskFactory.create_batch(2, project=project, n_answers=1)
-        for task in tasks:
-            TaskRunFactory.create(task=task)
-        result = self.result_repo.get_by(task_id=tasks[0].id)
-        result.info = dict(annotations=[{}])
-        self.result_repo.update(result)
-        self.base_analyst.analyse_all(project.id)
-        expected = [call(t.id, analyse_full=True) for t in tasks]
-        assert_equal(mock_analyse.call_args_list, expected)
+        project_id, results = self.create_project_results(2)
+        results[0].info = dict(annotations=[{}])
+        self.result_repo.update(results[0])
+        self.base_analyst.analyse_all(project_id)
+        calls = mock_analyse_result.call_args_list
+        assert_equal([c[0][0].id for c in calls], [r.id for r in results])
+        for c in calls:
+            assert_equal(c[1]['analyse_full'], True)
+            assert_equal(c[1]['annotations'], [])
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_all_prefetches_annotations(self, mock_analyse_result,
+                                                mock_client):
+        """Test that Annotations for all results are fetched together."""
+        project_id, results = self.create_project_results(2)
+        fake_anno = {
+            'id': 'foo',
+            'generator': [
+                {
+                    'id': url_for('api.api_task', oid=results[0].task_id),
+                    'type': 'Software'
+                }
+            ]
+        }
+        mock_client.get_collection.return_value = {'total': 1}
+        mock_client.iter_search_annotations.return_value = [fake_anno]
+        self.base_analyst.analyse_all(project_id)
+        assert_equal(mock_client.iter_search_annotations.call_count, 1)
+        calls = mock_analyse_result.call_args_list
+        assert_equal([c[1]['annotations'] for c in calls], [[fake_anno], []])
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_all_in_concurrent_chunks(self, mock_analyse_result,
+                                              mock_client):
+        """Test that all results are analysed in concurrent chunks."""
+        project_id, results = self.create_project_results(5)
+        config = dict(ANALYSIS_CHUNK_SIZE=2, ANALYSIS_WORKERS=2)
+        with patch.dict(flask_app.config, config):
+            self.base_analyst.analyse_all(project_id)
+        calls = mock_analyse_result.call_args_list
+        analysed = sorted(c[0][0].id for c in calls)
+        assert_equal(analysed, [r.id for r in results])
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_all_stops_on_error(self, mock_analyse_result,
+                                        mock_client):
+        """Test remaining chunks are abandoned if a chunk fails."""
+        project_id, results = self.create_project_results(6)
+        mock_analyse_result.side_effect = ValueError
+        config = dict(ANALYSIS_CHUNK_SIZE=1, ANALYSIS_WORKERS=2)
+        with patch.dict(flask_app.config, config):
+            assert_raises(ValueError, self.base_analyst.analyse_all,
+                          project_id)
+        assert_less_equal(mock_analyse_result.call_count, 2)
 
     @with_context
-    @patch("pybossa_lc.analysis.base.BaseAnalyst.analyse")
-    def test_analyse_empty(self, mock_analyse):
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch('pybossa_lc.model.base.Base.flush')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_all_flushed_on_error(self, mock_analyse_result,
+                                          mock_flush, mock_client):
+        """Test journalled writes are sent if analysis fails."""
+        project_id, results = self.create_project_results(2)
+        mock_analyse_result.side_effect = ValueError
+        mock_flush.side_effect = IOError
+        assert_raises(ValueError, self.base_analyst.analyse_all, project_id)
+        assert_equal(mock_flush.call_count, 1)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_all_loads_task_runs(self, mock_analyse_result,
+                                         mock_client):
+        """Test that results are analysed with their tasks and task runs."""
+        project_id, results = self.create_project_results(3)
+        self.base_analyst.analyse_all(project_id)
+        for c in mock_analyse_result.call_args_list:
+            result, task, task_runs = c[0][:3]
+            assert_equal(task.id, result.task_id)
+            assert_equal([tr.id for tr in task_runs],
+                         sorted(tr.id for tr in task.task_runs))
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch('pybossa_lc.analysis.queries.load_users')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_all_loads_users_per_chunk(self, mock_analyse_result,
+                                               mock_load_users, mock_client):
+        """Test that each chunk's commenting users are loaded once."""
+        mock_load_users.return_value = {}
+        project_id, results = self.create_project_results(3)
+        task_runs = [tr for r in results
+                     for tr in self.task_repo.get_task(r.task_id).task_runs]
+        commenters = set(tr.user_id for tr in task_runs[:2])
+
+        def get_comments(task_run_df):
+            return [(user_id, 'foo' if user_id in commenters else '')
+                    for user_id in task_run_df['user_id']]
+
+        self.base_analyst.get_comments = get_comments
+        self.base_analyst.analyse_all(project_id)
+        assert_equal(mock_load_users.call_count, 1)
+        assert_equal(set(mock_load_users.call_args[0][0]), commenters)
+        calls = mock_analyse_result.call_args_list
+        creators = [c[1]['creators'] for c in calls]
+        assert all(creator is creators[0] for creator in creators)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch('pybossa_lc.analysis.queries.load_users')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_all_prefetch_errors_ignored(self, mock_analyse_result,
+                                                 mock_load_users,
+                                                 mock_client):
+        """Test errors while prefetching commenters are left to analysis."""
+        mock_load_users.return_value = {}
+        project_id, results = self.create_project_results(2)
+        results[0].info = dict(has_children=True)
+        self.result_repo.update(results[0])
+        get_comments = MagicMock(side_effect=KeyError('info'))
+        self.base_analyst.get_comments = get_comments
+        self.base_analyst.analyse_all(project_id)
+        assert_equal(get_comments.call_count, 1)
+        calls = mock_analyse_result.call_args_list
+        assert_equal(sorted(c[0][0].id for c in calls),
+                     [r.id for r in results])
+        for c in calls:
+            assert_equal(c[1]['task_run_table'], None)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    @patch("pybossa_lc.analysis.base.BaseAnalyst._analyse_result")
+    def test_analyse_empty(self, mock_analyse_result, mock_client):
         """Test that empty results are analysed."""
-        project = ProjectFactory()
-        tasks = TaskFactory.create_batch(2, project=project, n_answers=1)
-        for task in tasks:
-            TaskRunFactory.create(task=task)
-        result = self.result_repo.get_by(task_id=tasks[0].id)
-        result.info = dict(annotations=[{}])
-        self.result_repo.update(result)
-        all_results = self.result_repo.filter_by(project_id=project.id)
-        self.base_analyst.analyse_empty(project.id)
-        expected = [call(r.task_id) for r in all_results if not r.info]
-        assert_equal(mock_analyse.call_args_list, expected)
+        project_id, results = self.create_project_results(2)
+        results[0].info = dict(annotations=[{}])
+        self.result_repo.update(results[0])
+        self.base_analyst.analyse_empty(project_id)
+        calls = mock_analyse_result.call_args_list
+        assert_equal([c[0][0].id for c in calls], [results[1].id])
 
     @with_context
     def test_key_dropped(self):
@@ -169,6 +302,22 @@ class TestBaseAnalyst(Test):
         df = self.base_analyst.get_task_run_df(task, [taskrun])
         assert_equal(df['_info'].tolist(), [info['info']])
 
+    @with_context
+    def test_task_run_not_modified_when_exploded(self):
+        """Test that exploding info returns a new dict of analysis keys."""
+        info = {'foo': 'bar'}
+        task = TaskFactory()
+        taskrun = TaskRunFactory.create(task=task, info=info)
+        exploded = self.base_analyst.explode_info(taskrun)
+        assert_dict_equal(exploded, {
+            'id': taskrun.id,
+            'user_id': taskrun.user_id,
+            'info': info,
+            'foo': 'bar'
+        })
+        assert_not_in('foo', taskrun.__dict__)
+        assert_not_in(taskrun, db.session.dirty)
+
     @with_context
     def test_user_ids_in_task_run_dataframe(self):
         """Test that user IDs are included in the task run dataframe."""
@@ -177,6 +326,18 @@ class TestBaseAnalyst(Test):
         df = self.base_analyst.get_task_run_df(task, taskruns)
         assert_equal(df['user_id'].tolist(), [tr.user_id for tr in taskruns])
 
+    @with_context
+    def test_get_task_run_table(self):
+        """Test the task run table with a dict as the info."""
+        info = {'foo': 'bar'}
+        task = TaskFactory()
+        taskruns = TaskRunFactory.create_batch(2, task=task, info=info)
+        table = self.base_analyst.get_task_run_table(task, taskruns)
+        assert_equal(table.index, [tr.id for tr in taskruns])
+        assert_equal(table['foo'], [info['foo']] * 2)
+        assert_equal(table['info'], [info] * 2)
+        assert_equal(table['user_id'], [tr.user_id for tr in taskruns])
+
     def test_titlecase_normalisation(self):
         """Test titlecase normalisation."""
         rules = dict(case='title')
@@ -326,6 +487,37 @@ class TestBaseAnalyst(Test):
         assert_equal(task.n_answers, n_answers - 1)
         assert_equal(task.state, 'completed')
 
+    @with_context
+    def test_n_answers_not_recounted_when_given(self):
+        """Test task runs are not queried when the number is given."""
+        task = TaskFactory.create(n_answers=1)
+        TaskRunFactory.create(task=task)
+        with patch('pybossa.core.task_repo.filter_task_runs_by') as mock_f:
+            self.base_analyst.update_n_answers_required(task, False,
+                                                        n_task_runs=1)
+            assert_equal(mock_f.called, False)
+        assert_equal(task.n_answers, 2)
+        assert_equal(task.state, 'ongoing')
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_n_answers_updated_in_bulk_for_analyse_all(self, mock_client):
+        """Test redundancy updated once per chunk when analysing all."""
+        n_answers = 2
+        task = self.ctx.create_task(n_answers, max_answers=n_answers + 1)
+        TaskRunFactory.create_batch(n_answers, task=task)
+        transcriptions = pandas.DataFrame({'reference': ['foo', 'bar']})
+        self.base_analyst.get_transcriptions_df = MagicMock()
+        self.base_analyst.get_transcriptions_df.return_value = transcriptions
+        self.base_analyst.get_comments = MagicMock(return_value=[])
+        self.base_analyst.get_tags = MagicMock(return_value={})
+        with patch('pybossa.core.task_repo.update') as mock_update:
+            self.base_analyst.analyse_all(task.project_id)
+            assert_equal(mock_update.called, False)
+        updated_task = self.task_repo.get_task(task.id)
+        assert_equal(updated_task.n_answers, n_answers + 1)
+        assert_equal(updated_task.state, 'ongoing')
+
     def test_overlap_ratio_is_1_with_equal_rects(self):
         """Test for an overlap ratio of 1."""
         rect = {'x': 100, 'y': 100, 'w': 100, 'h': 100}
@@ -482,6 +674,45 @@ class TestBaseAnalyst(Test):
         }
         mock_enqueue.assert_called_once_with(mock_send_mail, expected_msg)
 
+    def test_diff_annotations(self):
+        """Test only changed Annotations are deleted and added."""
+        def get_anno(value, tag, target='example.com'):
+            return {
+                'motivation': 'describing',
+                'target': target,
+                'body': [
+                    {'purpose': 'describing', 'value': value},
+                    {'purpose': 'tagging', 'value': tag}
+                ]
+            }
+        old = [
+            dict(get_anno('foo', 'title'), id='1'),
+            dict(get_anno('bar', 'date'), id='2'),
+            dict(get_anno('bar', 'date'), id='3'),
+            dict(get_anno('baz', 'author'), id='4')
+        ]
+        new = [
+            get_anno('foo', 'title'),
+            get_anno('bar', 'date'),
+            get_anno('qux', 'author'),
+            get_anno('baz', 'author', target='example.org')
+        ]
+        to_delete, to_add = self.base_analyst.diff_annotations(old, new)
+        assert_equal([anno['id'] for anno in to_delete], ['2', '4'])
+        assert_equal(to_add, new[2:])
+
+    def test_annotation_key_ignores_body_order(self):
+        """Test Annotation keys do not depend on the order of bodies."""
+        body = [
+            {'purpose': 'describing', 'value': 'foo'},
+            {'purpose': 'tagging', 'value': 'bar'}
+        ]
+        anno = dict(motivation='describing', target={'source': 'baz'},
+                    body=body)
+        reordered = dict(anno, body=body[::-1], id='qux')
+        assert_equal(self.base_analyst.get_annotation_key(anno),
+                     self.base_analyst.get_annotation_key(reordered))
+
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
     def test_modified_results_not_updated(self, mock_client):
@@ -490,10 +721,10 @@ class TestBaseAnalyst(Test):
         TaskRunFactory(task=task)
         result = self.result_repo.get_by(task_id=task.id)
         self.base_analyst.analyse(result.id)
-        mock_client.search_annotations.return_value = [{
+        mock_client.iter_search_annotations.return_value = [{
             'modified': 'fake-time'
         }]
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -505,7 +736,7 @@ class TestBaseAnalyst(Test):
         result.info = dict(has_children=True)
         self.result_repo.update(result)
         self.base_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -520,6 +751,34 @@ class TestBaseAnalyst(Test):
         self.base_analyst.analyse(result.id)
         assert_equal(result.info, info)
 
+    @with_context
+    @patch('pybossa_lc.analysis.base.annotation_journal')
+    @patch('pybossa_lc.analysis.base.ResultCollection')
+    def test_single_result_journal_flushed(self, mock_rc, mock_journal):
+        """Test journalled writes are sent once a result is analysed."""
+        mock_journal.enabled = True
+        mock_rc.return_value.iri = 'http://example.com/annotations/results/'
+        task = self.ctx.create_task(1)
+        TaskRunFactory(task=task)
+        result = self.result_repo.get_by(task_id=task.id)
+        self.base_analyst.analyse(result.id, annotations=[])
+        assert_equal(mock_rc.call_args[1], dict(write_behind=True))
+        assert_equal(mock_rc.return_value.flush.call_count, 1)
+
+    @with_context
+    @patch('pybossa_lc.analysis.base.annotation_journal')
+    @patch('pybossa_lc.analysis.base.ResultCollection')
+    def test_emailed_results_not_journalled(self, mock_rc, mock_journal):
+        """Test Annotations that may be emailed are written directly."""
+        mock_journal.enabled = True
+        mock_rc.return_value.iri = 'http://example.com/annotations/results/'
+        task = self.ctx.create_task(1)
+        TaskRunFactory(task=task)
+        result = self.result_repo.get_by(task_id=task.id)
+        self.base_analyst.analyse(result.id, silent=False,
+                                  annotations=[])
+        assert_equal(mock_rc.call_args[1], dict(write_behind=False))
+
     @with_context
     def test_analysis_exception_if_no_annotation_collection(self):
         """Test that AnnotationCollection must be setup."""
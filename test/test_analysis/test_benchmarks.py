@@ -0,0 +1,100 @@
+# -*- coding: utf8 -*-
+"""Benchmark analysis of large numbers of task runs."""
+
+import time
+import pandas
+from nose.tools import *
+from default import Test
+
+from pybossa_lc.analysis.iiif_annotation import IIIFAnnotationAnalyst
+from pybossa_lc.analysis.z3950 import Z3950Analyst
+from pybossa_lc.analysis.task_runs import TaskRunTable
+
+
+def time_calls(func, records):
+    """Return the result of a function and the seconds it took."""
+    start = time.time()
+    result = func(records)
+    return result, time.time() - start
+
+
+def get_iiif_comments_by_row(records):
+    """Return comments from IIIF task runs via DataFrame.iterrows."""
+    task_run_df = pandas.DataFrame(records)
+    comments = []
+    for _index, row in task_run_df.iterrows():
+        for anno in row['info']:
+            if anno['motivation'] == 'commenting':
+                comments.append((row['user_id'], anno['body']['value']))
+    return comments
+
+
+def get_z3950_comments_by_row(records):
+    """Return comments from Z39.50 task runs via DataFrame.iterrows."""
+    task_run_df = pandas.DataFrame(records)
+    return [(row['user_id'], row['comments'])
+            for _index, row in task_run_df.iterrows() if row['comments']]
+
+
+class TestBenchmarks(Test):
+
+    def setUp(self):
+        super(TestBenchmarks, self).setUp()
+        self.n_task_runs = 10000
+
+    def create_iiif_records(self):
+        """Return synthetic IIIF Annotation task runs."""
+        records = []
+        for i in range(self.n_task_runs):
+            info = [{
+                'motivation': 'tagging',
+                'body': {'value': 'title'}
+            }]
+            if i % 3 == 0:
+                info.append({
+                    'motivation': 'commenting',
+                    'body': {'value': 'Comment {}'.format(i)}
+                })
+            records.append(dict(id=i, user_id=i % 50, info=info))
+        return records
+
+    def create_z3950_records(self):
+        """Return synthetic Z39.50 task runs."""
+        return [dict(id=i, user_id=i % 50, reference='foo',
+                     control_number='bar',
+                     comments='Comment {}'.format(i) if i % 3 == 0 else '')
+                for i in range(self.n_task_runs)]
+
+    def test_iiif_comment_extraction_benchmark(self):
+        """Benchmark IIIF comment extraction from 10k task runs."""
+        analyst = IIIFAnnotationAnalyst()
+        records = self.create_iiif_records()
+
+        def get_comments_by_column(records):
+            return analyst.get_comments(TaskRunTable(records))
+
+        expected, row_time = time_calls(get_iiif_comments_by_row, records)
+        comments, table_time = time_calls(get_comments_by_column, records)
+
+        print('Extracted IIIF comments from {0} task runs in {1:.3f}s by row '
+              'and {2:.3f}s by column'.format(self.n_task_runs, row_time,
+                                              table_time))
+        assert_equal(comments, expected)
+        assert_less(table_time, row_time)
+
+    def test_z3950_comment_extraction_benchmark(self):
+        """Benchmark Z39.50 comment extraction from 10k task runs."""
+        analyst = Z3950Analyst()
+        records = self.create_z3950_records()
+
+        def get_comments_by_column(records):
+            return analyst.get_comments(TaskRunTable(records))
+
+        expected, row_time = time_calls(get_z3950_comments_by_row, records)
+        comments, table_time = time_calls(get_comments_by_column, records)
+
+        print('Extracted Z39.50 comments from {0} task runs in {1:.3f}s by '
+              'row and {2:.3f}s by column'.format(self.n_task_runs, row_time,
+                                                  table_time))
+        assert_equal(comments, expected)
+        assert_less(table_time, row_time)
@@ -0,0 +1,50 @@
+# -*- coding: utf8 -*-
+"""Test analysis caches."""
+
+from mock import patch, MagicMock
+from nose.tools import *
+from default import Test, with_context
+from factories import UserFactory
+
+from pybossa_lc.analysis.cache import CreatorCache
+
+
+class TestCreatorCache(Test):
+
+    def setUp(self):
+        super(TestCreatorCache, self).setUp()
+        self.rc = MagicMock()
+        self.rc._get_creator.side_effect = lambda user: dict(id=user.id,
+                                                             name=user.name)
+
+    @with_context
+    def test_creators_prefetched(self):
+        """Test creators are made for the users who are prefetched."""
+        users = UserFactory.create_batch(2)
+        creators = CreatorCache(self.rc)
+        creators.prefetch([users[0].id, users[1].id, users[0].id, None])
+        for user in users:
+            assert_equal(creators.get(user.id),
+                         dict(id=user.id, name=user.name))
+        assert_equal(self.rc._get_creator.call_count, 2)
+
+    @with_context
+    @patch('pybossa_lc.analysis.queries.load_users')
+    def test_users_loaded_in_bulk_once(self, mock_load_users):
+        """Test users are loaded in one query and then cached."""
+        user = MagicMock(id=1)
+        mock_load_users.return_value = {1: user}
+        creators = CreatorCache(self.rc)
+        creators.prefetch([1, 2])
+        creators.prefetch([1, 2])
+        creators.get(1)
+        creators.get(2)
+        assert_equal(mock_load_users.call_count, 1)
+        assert_equal(sorted(mock_load_users.call_args[0][0]), [1, 2])
+
+    @with_context
+    def test_unknown_and_anonymous_users_have_no_creator(self):
+        """Test None is returned for unknown and anonymous users."""
+        creators = CreatorCache(self.rc)
+        assert_equal(creators.get(None), None)
+        assert_equal(creators.get(12345), None)
@@ -0,0 +1,118 @@
+# -*- coding: utf8 -*-
+"""Test rectangle clustering."""
+
+import random
+import numpy
+from nose.tools import *
+from default import Test
+
+from pybossa_lc.analysis import clustering
+from pybossa_lc.analysis.base import BaseAnalyst
+
+
+class TestClustering(Test):
+
+    def setUp(self):
+        super(TestClustering, self).setUp()
+        BaseAnalyst.__abstractmethods__ = frozenset()
+        self.base_analyst = BaseAnalyst()
+
+    def test_overlap_matrix(self):
+        """Test the overlap matrix matches pairwise overlap ratios."""
+        rects = [
+            dict(x=100, y=100, w=100, h=100),
+            dict(x=150, y=100, w=100, h=100),
+            dict(x=100, y=201, w=100, h=100),
+            dict(x=0, y=0, w=0, h=0)
+        ]
+        boxes = clustering.to_boxes(rects)
+        ratios = clustering.overlap_matrix(boxes, boxes)
+        for i, r1 in enumerate(rects):
+            for j, r2 in enumerate(rects):
+                expected = self.base_analyst.get_overlap_ratio(r1, r2)
+                assert_almost_equal(ratios[i, j], expected)
+
+    def test_no_rects(self):
+        """Test no clusters are returned for no rects."""
+        assert_equal(clustering.cluster_rects([]), [])
+
+    def test_overlapping_rects_merged(self):
+        """Test overlapping rects are merged into their bounding box."""
+        rects = [
+            dict(x=90, y=100, w=110, h=90),
+            dict(x=100, y=110, w=90, h=100),
+            dict(x=110, y=90, w=100, h=110)
+        ]
+        clusters = clustering.cluster_rects(rects)
+        assert_equal(clusters, [dict(x=90, y=90, w=120, h=120)])
+
+    def test_chained_rects_merged(self):
+        """Test rects are merged when connected via other rects."""
+        rects = [
+            dict(x=0, y=0, w=100, h=100),
+            dict(x=200, y=0, w=100, h=100),
+            dict(x=20, y=0, w=100, h=100),
+            dict(x=40, y=0, w=100, h=100)
+        ]
+        clusters = clustering.cluster_rects(rects)
+        assert_equal(clusters, [
+            dict(x=0, y=0, w=140, h=100),
+            dict(x=200, y=0, w=100, h=100)
+        ])
+
+    def test_merge_ratio(self):
+        """Test rects are only merged when overlapping by the merge ratio."""
+        rects = [
+            dict(x=100, y=100, w=100, h=100),
+            dict(x=150, y=100, w=100, h=100)
+        ]
+        assert_equal(len(clustering.cluster_rects(rects, 0.5)), 2)
+        assert_equal(len(clustering.cluster_rects(rects, 0.3)), 1)
+
+    def test_clusters_do_not_depend_on_order(self):
+        """Test the same clusters are returned for any order of rects."""
+        rand = random.Random(42)
+        rects = []
+        for _i in range(50):
+            x = rand.randint(0, 1000)
+            y = rand.randint(0, 1000)
+            for _j in range(3):
+                rects.append(dict(x=x + rand.randint(-10, 10),
+                                  y=y + rand.randint(-10, 10),
+                                  w=rand.randint(40, 60),
+                                  h=rand.randint(40, 60)))
+        expected = clustering.cluster_rects(rects)
+        for _k in range(5):
+            rand.shuffle(rects)
+            assert_equal(clustering.cluster_rects(rects), expected)
+
+    def test_grid_index_matches_overlap_matrix(self):
+        """Test the grid index finds the same pairs as the overlap matrix."""
+        rand = random.Random(42)
+        rects = [dict(x=rand.randint(0, 2000), y=rand.randint(0, 2000),
+                      w=rand.randint(0, 300), h=rand.randint(0, 300))
+                 for _i in range(clustering.GRID_THRESHOLD * 4)]
+        boxes = clustering.to_boxes(rects)
+        for merge_ratio in [0, 0.1, 0.5]:
+            i, j = clustering.get_overlapping_pairs(boxes, merge_ratio)
+            ratios = clustering.overlap_matrix(boxes, boxes)
+            expected_i, expected_j = numpy.nonzero(
+                numpy.triu(ratios > merge_ratio, k=1))
+            assert_equal(sorted(zip(i, j)),
+                         sorted(zip(expected_i, expected_j)))
+
+    def test_grid_index_with_oversized_box(self):
+        """Test a box much larger than the rest is compared directly."""
+        rand = random.Random(42)
+        rects = [dict(x=0, y=0, w=10000, h=10000)]
+        rects += [dict(x=rand.randint(0, 10000), y=rand.randint(0, 10000),
+                       w=5, h=5)
+                  for _i in range(clustering.GRID_THRESHOLD * 4)]
+        boxes = clustering.to_boxes(rects)
+        i, j = clustering.get_grid_pairs(boxes)
+        assert_equal(sorted(zip(i, j))[:len(rects) - 1],
+                     [(0, k) for k in range(1, len(rects))])
+        i, j = clustering.get_overlapping_pairs(boxes, 0)
+        ratios = clustering.overlap_matrix(boxes, boxes)
+        expected_i, expected_j = numpy.nonzero(numpy.triu(ratios > 0, k=1))
+        assert_equal(sorted(zip(i, j)), sorted(zip(expected_i, expected_j)))
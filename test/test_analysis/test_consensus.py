@@ -0,0 +1,104 @@
+# -*- coding: utf8 -*-
+"""Test consensus."""
+
+import numpy
+import pandas
+from nose.tools import *
+from default import Test
+
+from pybossa_lc.analysis import consensus, AnalysisException
+
+
+class TestConsensus(Test):
+
+    def test_modal_values_returned(self):
+        """Test the modal value of each field is returned."""
+        df = pandas.DataFrame({
+            'foo': ['bar', 'baz', 'bar'],
+            'qux': ['quux', 'quux', 'corge']
+        })
+        has_matches, values = consensus.get_consensus(df, 2)
+        assert_equal(has_matches, True)
+        assert_equal(values, {'foo': 'bar', 'qux': 'quux'})
+        assert_equal(values.keys(), df.columns.tolist())
+
+    def test_no_matches_when_any_field_below_min_answers(self):
+        """Test no matches when any field has too few matching values."""
+        df = pandas.DataFrame({
+            'foo': ['bar', 'bar', 'bar'],
+            'qux': ['quux', 'corge', 'grault']
+        })
+        has_matches, _values = consensus.get_consensus(df, 2)
+        assert_equal(has_matches, False)
+
+    def test_no_matches_when_empty(self):
+        """Test no matches for an empty dataframe."""
+        has_matches, values = consensus.get_consensus(pandas.DataFrame(), 1)
+        assert_equal(has_matches, False)
+        assert_equal(values, {})
+
+    def test_missing_values_counted_but_not_chosen(self):
+        """Test missing values count as matches but are not chosen."""
+        count, mode = consensus.get_mode(['foo', numpy.nan, None, ''])
+        assert_equal(count, 3)
+        assert_equal(mode, 'foo')
+
+    def test_first_value_to_reach_max_count_chosen(self):
+        """Test ties are resolved by the first value to reach the count."""
+        count, mode = consensus.get_mode(['foo', 'bar', 'bar', 'foo'])
+        assert_equal(count, 2)
+        assert_equal(mode, 'bar')
+
+    def test_within_distance(self):
+        """Test strings are checked to be within an edit distance."""
+        assert consensus.within_distance('foo', 'foo', 0)
+        assert consensus.within_distance('kitten', 'sitting', 3)
+        assert not consensus.within_distance('kitten', 'sitting', 2)
+        assert consensus.within_distance('', 'ab', 2)
+        assert not consensus.within_distance('abcdef', 'ab', 3)
+        assert not consensus.within_distance('abcd', 'badc', 1)
+
+    def test_edit_distance_consensus(self):
+        """Test values within the maximum edit distance match."""
+        strategy = consensus.EditDistanceConsensus(1)
+        values = ['Jon Smith', 'John Smith', 'John Smith', None, 'Jane Doe']
+        count, mode = strategy.get_mode(values)
+        assert_equal(count, 3)
+        assert_equal(mode, 'John Smith')
+
+    def test_token_set_consensus(self):
+        """Test values with similar sets of words match."""
+        strategy = consensus.TokenSetConsensus(0.6)
+        values = ['Smith, John', 'john smith', 'John  Smith', 'Jane Doe']
+        count, mode = strategy.get_mode(values)
+        assert_equal(count, 3)
+        assert_equal(mode, 'Smith, John')
+
+    def test_empty_values_only_match_empty_values(self):
+        """Test fuzzy consensus does not match empty values to others."""
+        strategy = consensus.EditDistanceConsensus(1)
+        count, mode = strategy.get_mode(['a', '', None, 'b'])
+        assert_equal(count, 2)
+        assert_equal(mode, 'a')
+
+    def test_consensus_with_strategy(self):
+        """Test consensus is found with a strategy."""
+        df = pandas.DataFrame({'foo': ['bar', 'baz', 'bay']})
+        strategy = consensus.EditDistanceConsensus(1)
+        has_matches, values = consensus.get_consensus(df, 3, strategy)
+        assert_equal(has_matches, True)
+        assert_equal(values, {'foo': 'bar'})
+
+    def test_get_strategy(self):
+        """Test the consensus strategy is chosen by the rules."""
+        assert_is_instance(consensus.get_strategy({}),
+                           consensus.ExactConsensus)
+        assert_is_instance(consensus.get_strategy(None),
+                           consensus.ExactConsensus)
+        strategy = consensus.get_strategy(dict(consensus='edit_distance',
+                                               max_distance=2))
+        assert_equal(strategy.max_distance, 2)
+        strategy = consensus.get_strategy(dict(consensus='token_set'))
+        assert_equal(strategy.min_similarity, 0.8)
+        assert_raises(AnalysisException, consensus.get_strategy,
+                      dict(consensus='foo'))
@@ -11,6 +11,7 @@ from pybossa.repositories import ResultRepository, TaskRepository
 
 from ..fixtures.context import ContextFixtures
 from pybossa_lc.analysis.iiif_annotation import IIIFAnnotationAnalyst
+from pybossa_lc.analysis.task_runs import TaskRunTable
 
 
 class TestIIIFAnnotationAnalyst(Test):
@@ -110,6 +111,29 @@ class TestIIIFAnnotationAnalyst(Test):
         expected = [(1, comment) for comment in self.comments]
         assert_equal(comments, expected)
 
+    def test_get_comments_from_task_run_table(self):
+        """Test IIIF Annotation comments are returned from a table."""
+        records = [dict(user_id=user_id, info=info) for user_id, info
+                   in zip(self.data['user_id'], self.data['info'])]
+        table = TaskRunTable(records)
+        comments = self.iiif_analyst.get_comments(table)
+        expected = [(1, comment) for comment in self.comments]
+        assert_equal(comments, expected)
+
+    def test_annotations_grouped_once_per_task_run_table(self):
+        """Test IIIF Annotations are validated and grouped once per table."""
+        records = [dict(user_id=user_id, info=info) for user_id, info
+                   in zip(self.data['user_id'], self.data['info'])]
+        table = TaskRunTable(records)
+        with patch.object(self.iiif_analyst, '_validate') as mock_validate:
+            comments = self.iiif_analyst.get_comments(table)
+            tags = self.iiif_analyst.get_tags(table)
+            df = self.iiif_analyst.get_transcriptions_df(table)
+        assert_equal(mock_validate.call_count, 1)
+        assert_equal(comments, [(1, comment) for comment in self.comments])
+        assert_dict_equal(tags, self.tags)
+        assert_dict_equal(df.to_dict(), self.transcriptions_df.to_dict())
+
     def test_get_tags(self):
         """Test IIIF Annotation tags are returned."""
         task_run_df = pandas.DataFrame(self.data)
@@ -159,9 +183,9 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -199,10 +223,10 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        func.assert_called_once_with(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [{
             'motivation': 'describing',
             'type': 'Annotation',
             'generator': [
@@ -231,7 +255,7 @@ class TestIIIFAnnotationAnalyst(Test):
                 }
             ],
             'target': source
-        })
+        }])
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -255,10 +279,10 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        func.assert_called_once_with(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [{
             'motivation': 'commenting',
             'type': 'Annotation',
             'creator': {
@@ -286,7 +310,7 @@ class TestIIIFAnnotationAnalyst(Test):
                 'format': 'text/plain'
             },
             'target': target
-        })
+        }])
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -320,10 +344,10 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        func.assert_called_once_with(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [{
             'motivation': 'describing',
             'type': 'Annotation',
             'generator': [
@@ -352,7 +376,7 @@ class TestIIIFAnnotationAnalyst(Test):
                 }
             ],
             'target': target
-        })
+        }])
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -381,10 +405,10 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        func.assert_called_once_with(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [{
             'motivation': 'describing',
             'type': 'Annotation',
             'generator': [
@@ -413,7 +437,7 @@ class TestIIIFAnnotationAnalyst(Test):
                 }
             ],
             'target': target
-        })
+        }])
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -440,9 +464,9 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
         updated_task = self.task_repo.get_task(task.id)
         assert_equal(updated_task.n_answers, n_answers + 1)
@@ -471,9 +495,9 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
         updated_task = self.task_repo.get_task(task.id)
         assert_equal(updated_task.n_answers, n_answers)
@@ -506,7 +530,7 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
         updated_task = self.task_repo.get_task(task.id)
         assert_equal(updated_task.n_answers, n_answers)
@@ -532,7 +556,7 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
 
         updated_task = self.task_repo.get_task(task.id)
@@ -563,11 +587,11 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
         updated_task = self.task_repo.get_task(task.id)
         assert_equal(updated_task.n_answers, n_answers)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -602,10 +626,10 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        func.assert_called_once_with(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [{
             'motivation': 'tagging',
             'type': 'Annotation',
             'generator': [
@@ -636,7 +660,7 @@ class TestIIIFAnnotationAnalyst(Test):
                                                             rect['h'])
                 }
             }
-        })
+        }])
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -671,10 +695,10 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        func.assert_called_once_with(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [{
             'motivation': 'tagging',
             'type': 'Annotation',
             'generator': [
@@ -705,7 +729,7 @@ class TestIIIFAnnotationAnalyst(Test):
                                                             rect['h'])
                 }
             }
-        })
+        }])
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -744,10 +768,10 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        func.assert_called_once_with(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [{
             'motivation': 'tagging',
             'type': 'Annotation',
             'generator': [
@@ -772,10 +796,10 @@ class TestIIIFAnnotationAnalyst(Test):
                 'selector': {
                     'conformsTo': 'http://www.w3.org/TR/media-frags/',
                     'type': 'FragmentSelector',
-                    'value': '?xywh=90,90,120,110'
+                    'value': '?xywh=90,90,120,120'
                 }
             }
-        })
+        }])
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -814,10 +838,11 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.call_args_list, [
-            call(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [
+            {
                 'motivation': 'tagging',
                 'type': 'Annotation',
                 'generator': [
@@ -848,8 +873,8 @@ class TestIIIFAnnotationAnalyst(Test):
                                                                 rect1['h'])
                     }
                 }
-            }),
-            call(anno_collection, {
+            },
+            {
                 'motivation': 'tagging',
                 'type': 'Annotation',
                 'generator': [
@@ -880,8 +905,8 @@ class TestIIIFAnnotationAnalyst(Test):
                                                                 rect2['h'])
                     }
                 }
-            }),
-            call(anno_collection, {
+            },
+            {
                 'motivation': 'tagging',
                 'type': 'Annotation',
                 'generator': [
@@ -912,7 +937,7 @@ class TestIIIFAnnotationAnalyst(Test):
                                                                 rect3['h'])
                     }
                 }
-            })
+            }
         ])
 
     @with_context
@@ -942,7 +967,7 @@ class TestIIIFAnnotationAnalyst(Test):
         ]
         fake_search = MagicMock()
         fake_search.return_value = fake_annos
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id, analyse_full=True)
         mock_client.delete_batch.assert_called_once_with(fake_annos)
 
@@ -973,7 +998,7 @@ class TestIIIFAnnotationAnalyst(Test):
         ]
         fake_search = MagicMock()
         fake_search.return_value = fake_annos
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
         assert_equal(mock_client.delete_batch.called, False)
 
@@ -998,7 +1023,7 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
         assert_dict_equal(result.info, {
             'annotations': anno_collection
@@ -1021,9 +1046,9 @@ class TestIIIFAnnotationAnalyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.iiif_analyst.analyse(result.id)
-        assert not mock_client.create_annotation.called
+        assert not mock_client.create_batch.called
         assert_dict_equal(result.info, {
             'annotations': anno_collection,
             'rejected': reason
@@ -0,0 +1,136 @@
+# -*- coding: utf8 -*-
+"""Test transcription normalisation."""
+
+import time
+import random
+from mock import patch, MagicMock
+from nose.tools import *
+from default import Test
+
+from pybossa_lc.analysis import normalisation
+from pybossa_lc.analysis.normalisation import Normaliser
+from pybossa_lc.analysis.cache import LRUCache
+
+
+def get_date_corpus(n_dates):
+    """Return a corpus of dates in the forms that volunteers transcribe."""
+    rand = random.Random(42)
+    months = ['January', 'Feb', 'March', 'Apr', 'May', 'June', 'Jul',
+              'August', 'Sept', 'Oct', 'November', 'Dec']
+    forms = [
+        lambda d, m, y: '{0}/{1}/{2}'.format(d, m, y),
+        lambda d, m, y: '{0:02d}.{1:02d}.{2}'.format(d, m, y),
+        lambda d, m, y: '{2}-{1:02d}-{0:02d}'.format(d, m, y),
+        lambda d, m, y: '{0} {1} {2}'.format(d, months[m - 1], y),
+        lambda d, m, y: '{0}th {1}, {2}'.format(d, months[m - 1], y),
+        lambda d, m, y: '{1} {0}, {2}'.format(d, months[m - 1], y),
+        lambda d, m, y: '{0}'.format(y),
+        lambda d, m, y: '{0}/{1}'.format(d, m),
+        lambda d, m, y: '{0} {1}. {2}'.format(d, months[m - 1], y),
+        lambda d, m, y: 'Not known'
+    ]
+    corpus = []
+    for _i in range(n_dates):
+        form = rand.choice(forms)
+        date = form(rand.randint(1, 31), rand.randint(1, 12),
+                    rand.randint(1700, 1999))
+        corpus.append(date)
+    return corpus
+
+
+class TestNormalisation(Test):
+
+    def test_steps_compiled_from_rules(self):
+        """Test only the steps enabled by the rules are compiled."""
+        normaliser = Normaliser(dict(case='upper', whitespace='foo',
+                                     trim_punctuation=False))
+        assert_equal(normaliser.steps, [normalisation.CASE['upper']])
+        assert_equal(Normaliser({}).steps, [])
+        assert_equal(Normaliser(None).steps, [])
+
+    def test_steps_applied_in_order(self):
+        """Test the steps are applied in order."""
+        rules = dict(case='title', whitespace='underscore',
+                     trim_punctuation=True)
+        normaliser = Normaliser(rules)
+        assert_equal(normaliser(' some  words. '), 'Some_Words')
+
+    def test_non_strings_not_normalised(self):
+        """Test that values other than strings are returned unchanged."""
+        normaliser = Normaliser(dict(case='upper'))
+        assert_equal(normaliser(None), None)
+        assert_equal(normaliser(42), 42)
+
+    def test_normalised_values_cached(self):
+        """Test that each value is only normalised once."""
+        normaliser = Normaliser(dict(case='upper'))
+        step = MagicMock(return_value='BAR')
+        normaliser.steps = [step]
+        assert_equal(normaliser('bar'), 'BAR')
+        assert_equal(normaliser('bar'), 'BAR')
+        step.assert_called_once_with('bar')
+
+    def test_least_recently_used_values_discarded(self):
+        """Test that the least recently used values are discarded."""
+        cache = LRUCache(2)
+        cache.set('foo', 1)
+        cache.set('bar', 2)
+        cache.get('foo')
+        cache.set('baz', 3)
+        assert_equal(len(cache), 2)
+        assert_equal(cache.get('bar'), None)
+        assert_equal(cache.get('foo'), 1)
+        assert_equal(cache.get('baz'), 3)
+
+    def test_normaliser_shared_for_equal_rules(self):
+        """Test that the same Normaliser is returned for equal rules."""
+        normaliser = normalisation.get_normaliser(dict(case='lower',
+                                                       date_format=False))
+        other = normalisation.get_normaliser(dict(date_format=False,
+                                                  case='lower'))
+        assert normaliser is other
+        assert normalisation.get_normaliser(dict(case='upper')) is not other
+
+    def test_common_dates_normalised_as_with_dateutil(self):
+        """Test the fast path normalises dates the same as dateutil."""
+        corpus = get_date_corpus(2000)
+        for dayfirst in [True, False]:
+            for yearfirst in [True, False]:
+                fast = [normalisation.normalise_date(value, dayfirst,
+                                                     yearfirst)
+                        for value in corpus]
+                with patch.object(normalisation, 'parse_common_date',
+                                  return_value=None):
+                    slow = [normalisation.normalise_date(value, dayfirst,
+                                                         yearfirst)
+                            for value in corpus]
+                assert_equal(fast, slow)
+
+    def test_common_dates_parsed(self):
+        """Test the common forms of date are parsed without dateutil."""
+        dates = ['19/11/1984', '19-11-1984', '1984-11-19', '19 Nov 1984',
+                 '19th November, 1984', 'November 19, 1984', '1984']
+        for value in dates:
+            assert_not_equal(normalisation.parse_common_date(value), None)
+        for value in ['19/11', '0001', '31/31/1984', '31/02/1984', 'foo']:
+            assert_equal(normalisation.parse_common_date(value), None)
+
+    def test_date_normalisation_benchmark(self):
+        """Benchmark date normalisation with and without the fast path."""
+        corpus = get_date_corpus(5000)
+        start = time.time()
+        for value in corpus:
+            normalisation.normalise_date(value, True, False)
+        fast_time = time.time() - start
+
+        start = time.time()
+        with patch.object(normalisation, 'parse_common_date',
+                          return_value=None):
+            for value in corpus:
+                normalisation.normalise_date(value, True, False)
+        slow_time = time.time() - start
+
+        print('Normalised {0} dates in {1:.3f}s with the fast path and '
+              '{2:.3f}s with dateutil only'.format(len(corpus), fast_time,
+                                                   slow_time))
+        assert_less(fast_time, slow_time)
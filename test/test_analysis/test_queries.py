@@ -0,0 +1,115 @@
+# -*- coding: utf8 -*-
+"""Test analysis queries."""
+
+from nose.tools import *
+from default import db, Test, with_context
+from factories import TaskFactory, TaskRunFactory, ProjectFactory
+from factories import UserFactory
+from pybossa.repositories import ResultRepository, TaskRepository
+
+from pybossa_lc.analysis.queries import iter_empty_result_ids
+from pybossa_lc.analysis.queries import get_result_task_ids, load_results
+from pybossa_lc.analysis.queries import update_task_redundancy
+from pybossa_lc.analysis.queries import load_task_runs, load_users
+
+
+class TestQueries(Test):
+
+    def setUp(self):
+        super(TestQueries, self).setUp()
+        self.result_repo = ResultRepository(db)
+        self.task_repo = TaskRepository(db)
+
+    @with_context
+    def test_iter_empty_result_ids(self):
+        """Test the IDs of empty results are returned in order."""
+        project = ProjectFactory()
+        tasks = TaskFactory.create_batch(4, project=project, n_answers=1)
+        for task in tasks:
+            TaskRunFactory.create(task=task)
+        results = self.result_repo.filter_by(project_id=project.id)
+        results = sorted(results, key=lambda r: r.id)
+        results[0].info = dict(annotations='foo')
+        results[2].info = {}
+        self.result_repo.update(results[0])
+        self.result_repo.update(results[2])
+
+        other_project = ProjectFactory()
+        other_task = TaskFactory.create(project=other_project, n_answers=1)
+        TaskRunFactory.create(task=other_task)
+
+        result_ids = list(iter_empty_result_ids(project.id, batch_size=1))
+        assert_equal(result_ids, [r.id for r in results[1:]])
+
+    @with_context
+    def test_get_result_task_ids(self):
+        """Test result and task IDs are returned for a project."""
+        project = ProjectFactory()
+        tasks = TaskFactory.create_batch(3, project=project, n_answers=1)
+        for task in tasks:
+            TaskRunFactory.create(task=task)
+        results = self.result_repo.filter_by(project_id=project.id)
+        expected = sorted((r.id, r.task_id) for r in results)
+        assert_equal(get_result_task_ids(project.id), expected)
+
+    @with_context
+    def test_load_results(self):
+        """Test results are loaded with their tasks and task runs."""
+        project = ProjectFactory()
+        tasks = TaskFactory.create_batch(3, project=project, n_answers=2)
+        for task in tasks:
+            TaskRunFactory.create_batch(2, task=task)
+        results = self.result_repo.filter_by(project_id=project.id)
+        loaded = load_results([r.id for r in results[:2]])
+        assert_equal(sorted(loaded.keys()), sorted(r.id for r in results[:2]))
+        for result_id, (result, task, task_runs) in loaded.items():
+            assert_equal(result.id, result_id)
+            assert_equal(task.id, result.task_id)
+            assert_equal([tr.id for tr in task_runs],
+                         sorted(tr.id for tr in task.task_runs))
+
+    @with_context
+    def test_load_task_runs(self):
+        """Test only the analysis columns of task runs are loaded."""
+        task = TaskFactory.create(n_answers=2)
+        task_runs = TaskRunFactory.create_batch(2, task=task,
+                                                info=dict(foo='bar'))
+        loaded = load_task_runs([task.id])
+        assert_equal(loaded.keys(), [task.id])
+        rows = loaded[task.id]
+        assert_equal([row.id for row in rows], [tr.id for tr in task_runs])
+        assert_equal([row.user_id for row in rows],
+                     [tr.user_id for tr in task_runs])
+        assert_equal([row.info for row in rows], [dict(foo='bar')] * 2)
+        assert_equal(sorted(rows[0].keys()),
+                     ['id', 'info', 'task_id', 'user_id'])
+
+    @with_context
+    def test_load_users(self):
+        """Test the names of a set of users are loaded."""
+        users = UserFactory.create_batch(3)
+        loaded = load_users([users[0].id, users[2].id])
+        assert_equal(sorted(loaded.keys()), [users[0].id, users[2].id])
+        for user in [users[0], users[2]]:
+            row = loaded[user.id]
+            assert_equal((row.id, row.name, row.fullname),
+                         (user.id, user.name, user.fullname))
+        assert_equal(load_users([]), {})
+
+    @with_context
+    def test_update_task_redundancy(self):
+        """Test the redundancy of a set of tasks is updated."""
+        project = ProjectFactory()
+        tasks = TaskFactory.create_batch(3, project=project, n_answers=2)
+        update_task_redundancy([
+            dict(id=tasks[0].id, project_id=project.id, state='ongoing',
+                 n_answers=3),
+            dict(id=tasks[1].id, project_id=project.id, state='completed',
+                 n_answers=1)
+        ])
+        updated = [self.task_repo.get_task(task.id) for task in tasks]
+        assert_equal([(t.state, t.n_answers) for t in updated], [
+            ('ongoing', 3),
+            ('completed', 1),
+            ('ongoing', 2)
+        ])
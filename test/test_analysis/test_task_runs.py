@@ -0,0 +1,53 @@
+# -*- coding: utf8 -*-
+"""Test task run table."""
+
+from nose.tools import *
+from default import Test
+
+from pybossa_lc.analysis.task_runs import TaskRunTable
+
+
+class TestTaskRunTable(Test):
+
+    def setUp(self):
+        super(TestTaskRunTable, self).setUp()
+        self.records = [
+            {'user_id': 1, 'foo': 'bar'},
+            {'user_id': 2, 'baz': 'qux'}
+        ]
+
+    def test_columns(self):
+        """Test the table has a list of values per key."""
+        table = TaskRunTable(self.records, [10, 11])
+        assert_equal(len(table), 2)
+        assert_equal(table.index, [10, 11])
+        assert_equal(table['user_id'], [1, 2])
+        assert_in('foo', table)
+        assert_not_in('quux', table)
+        assert_equal(sorted(table.keys()), ['baz', 'foo', 'user_id'])
+
+    def test_missing_values_are_none(self):
+        """Test that keys missing from a task run are given None."""
+        table = TaskRunTable(self.records)
+        assert_equal(table['foo'], ['bar', None])
+        assert_equal(table['baz'], [None, 'qux'])
+
+    def test_missing_key_raises_key_error(self):
+        """Test that getting a missing key raises a KeyError."""
+        table = TaskRunTable(self.records)
+        assert_raises(KeyError, table.__getitem__, 'quux')
+        assert_equal(table.get('quux'), None)
+
+    def test_empty_table(self):
+        """Test an empty table."""
+        table = TaskRunTable([])
+        assert_equal(len(table), 0)
+        assert table.empty
+
+    def test_to_dataframe(self):
+        """Test the table is converted to a dataframe."""
+        table = TaskRunTable(self.records, [10, 11])
+        df = table.to_dataframe()
+        assert_equal(df.index.tolist(), [10, 11])
+        assert_equal(df['user_id'].tolist(), [1, 2])
+        assert_equal(df['foo'].tolist(), ['bar', None])
@@ -68,9 +68,9 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -87,9 +87,9 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -106,9 +106,9 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -125,9 +125,9 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -148,10 +148,10 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        func.assert_called_once_with(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [{
             'motivation': 'commenting',
             'type': 'Annotation',
             'creator': {
@@ -179,7 +179,7 @@ class TestZ3950Analyst(Test):
                 'format': 'text/plain'
             },
             'target': target
-        })
+        }])
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -203,10 +203,11 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.call_args_list, [
-            call(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [
+            {
                 'motivation': 'describing',
                 'type': 'Annotation',
                 'generator': [
@@ -235,8 +236,8 @@ class TestZ3950Analyst(Test):
                     }
                 ],
                 'target': target
-            }),
-            call(anno_collection, {
+            },
+            {
                 'motivation': 'describing',
                 'type': 'Annotation',
                 'generator': [
@@ -265,7 +266,7 @@ class TestZ3950Analyst(Test):
                     }
                 ],
                 'target': target
-            })
+            }
         ])
 
     @with_context
@@ -287,11 +288,11 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        func = mock_client.create_annotation
-        assert_equal(mock_client.create_annotation.call_args_list, [
-            call(anno_collection, {
+        func = mock_client.create_batch
+        func.assert_called_once_with(anno_collection, [
+            {
                 'motivation': 'describing',
                 'type': 'Annotation',
                 'generator': [
@@ -320,8 +321,8 @@ class TestZ3950Analyst(Test):
                     }
                 ],
                 'target': target
-            }),
-            call(anno_collection, {
+            },
+            {
                 'motivation': 'describing',
                 'type': 'Annotation',
                 'generator': [
@@ -350,9 +351,31 @@ class TestZ3950Analyst(Test):
                     }
                 ],
                 'target': target
-            })
+            }
         ])
 
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_with_fuzzy_matching_transcriptions(self, mock_client):
+        """Test Z3950 results with transcriptions within an edit distance."""
+        n_answers = 3
+        rules = dict(consensus='edit_distance', max_distance=1)
+        task = self.ctx.create_task(n_answers, rules=rules)
+        references = ['OR 123 456', 'OR 123 45', 'OR 123 456']
+        control_numbers = ['123', '124', '123']
+        for reference, control_number in zip(references, control_numbers):
+            TaskRunFactory.create(task=task, info={
+                'reference': reference,
+                'control_number': control_number,
+                'comments': ''
+            })
+        result = self.result_repo.filter_by(project_id=task.project_id)[0]
+        mock_client.iter_search_annotations.return_value = []
+        self.z3950_analyst.analyse(result.id)
+        annotations = mock_client.create_batch.call_args[0][1]
+        values = [anno['body'][0]['value'] for anno in annotations]
+        assert_equal(values, ['123', 'OR 123 456'])
+
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
     def test_redundancy_increased_when_not_max(self, mock_client):
@@ -369,9 +392,9 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
         updated_task = self.task_repo.get_task(task.id)
         assert_equal(updated_task.n_answers, n_answers + 1)
@@ -392,9 +415,9 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
 
         updated_task = self.task_repo.get_task(task.id)
         assert_equal(updated_task.n_answers, n_answers)
@@ -416,7 +439,7 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
         updated_task = self.task_repo.get_task(task.id)
         assert_equal(updated_task.n_answers, n_answers)
@@ -438,11 +461,63 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
         updated_task = self.task_repo.get_task(task.id)
         assert_equal(updated_task.n_answers, n_answers)
-        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_unchanged_annotations_not_rewritten(self, mock_client):
+        """Test Z3950 re-analysis makes no writes if nothing has changed."""
+        n_answers = 3
+        target = 'example.com'
+        task = self.ctx.create_task(n_answers, target)
+        TaskRunFactory.create_batch(n_answers, task=task, info={
+            'reference': 'foo',
+            'control_number': 'bar',
+            'comments': ''
+        })
+        result = self.result_repo.filter_by(project_id=task.project_id)[0]
+        mock_client.iter_search_annotations.return_value = []
+        self.z3950_analyst.analyse(result.id)
+        created = mock_client.create_batch.call_args[0][1]
+        assert_equal(len(created), 2)
+
+        mock_client.reset_mock()
+        mock_client.iter_search_annotations.return_value = [
+            dict(anno, id=str(i)) for i, anno in enumerate(created)
+        ]
+        self.z3950_analyst.analyse(result.id, analyse_full=True)
+        assert_equal(mock_client.delete_batch.called, False)
+        assert_equal(mock_client.create_batch.called, False)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_annotations_replaced_if_configured(self, mock_client):
+        """Test Z3950 re-analysis can replace every Annotation."""
+        n_answers = 3
+        target = 'example.com'
+        task = self.ctx.create_task(n_answers, target)
+        TaskRunFactory.create_batch(n_answers, task=task, info={
+            'reference': 'foo',
+            'control_number': 'bar',
+            'comments': ''
+        })
+        result = self.result_repo.filter_by(project_id=task.project_id)[0]
+        mock_client.iter_search_annotations.return_value = []
+        self.z3950_analyst.analyse(result.id)
+        created = mock_client.create_batch.call_args[0][1]
+
+        mock_client.reset_mock()
+        old_annos = [dict(anno, id=str(i)) for i, anno in enumerate(created)]
+        mock_client.iter_search_annotations.return_value = old_annos
+        config = dict(ANALYSIS_REPLACE_ANNOTATIONS=True)
+        with patch.dict(flask_app.config, config):
+            self.z3950_analyst.analyse(result.id, analyse_full=True)
+        mock_client.delete_batch.assert_called_once_with(old_annos)
+        assert_equal(mock_client.create_batch.call_args[0][1], created)
 
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
@@ -467,7 +542,7 @@ class TestZ3950Analyst(Test):
         ]
         fake_search = MagicMock()
         fake_search.return_value = fake_annos
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id, analyse_full=True)
         mock_client.delete_batch.assert_called_once_with(fake_annos)
 
@@ -494,7 +569,7 @@ class TestZ3950Analyst(Test):
         ]
         fake_search = MagicMock()
         fake_search.return_value = fake_annos
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
         assert_equal(mock_client.delete_batch.called, False)
 
@@ -515,7 +590,7 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
         assert_dict_equal(result.info, {
             'annotations': anno_collection
@@ -538,9 +613,9 @@ class TestZ3950Analyst(Test):
         result = self.result_repo.filter_by(project_id=task.project_id)[0]
         fake_search = MagicMock()
         fake_search.return_value = []
-        mock_client.search_annotations = fake_search
+        mock_client.iter_search_annotations = fake_search
         self.z3950_analyst.analyse(result.id)
-        assert not mock_client.create_annotation.called
+        assert not mock_client.create_batch.called
         assert_dict_equal(result.info, {
             'annotations': anno_collection,
             'rejected': reason
@@ -0,0 +1,240 @@
+# -*- coding: utf8 -*-
+
+import os
+import time
+import shutil
+import tempfile
+from nose.tools import *
+from mock import MagicMock, call, patch
+from default import Test
+from requests.exceptions import HTTPError
+
+from pybossa_lc.annotation_journal import AnnotationJournal, LOCK_FILENAME
+
+
+class TestAnnotationJournal(Test):
+
+    def setUp(self):
+        super(TestAnnotationJournal, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.client = MagicMock()
+        self.journals = []
+        self.iri = 'http://example.com/annotations/results/'
+
+    def tearDown(self):
+        for journal in self.journals:
+            journal.close()
+        shutil.rmtree(self.directory)
+        super(TestAnnotationJournal, self).tearDown()
+
+    def get_journal(self, interval=60, fsync=True):
+        app = MagicMock(config={
+            'WEB_ANNOTATION_JOURNAL_DIR': self.directory,
+            'WEB_ANNOTATION_JOURNAL_INTERVAL': interval,
+            'WEB_ANNOTATION_JOURNAL_FSYNC': fsync
+        })
+        journal = AnnotationJournal(self.client)
+        journal.init_app(app)
+        self.journals.append(journal)
+        return journal
+
+    def get_anno(self, task_id, value):
+        return {
+            'type': 'Annotation',
+            'generator': [
+                {'id': 'https://github.com/LibCrowds/libcrowds'},
+                {'id': 'http://example.com/api/task/{}'.format(task_id)}
+            ],
+            'body': {'value': value}
+        }
+
+    def stop(self, journal):
+        """Stop a journal without flushing, as if its process had exited."""
+        journal._stopped.set()
+        journal._thread.join()
+        journal._lock_file.close()
+        journal._lock_file = None
+        journal._pid = None
+
+    def get_segments(self):
+        """Return the paths to each segment, relative to the directory."""
+        segments = []
+        for dirname in os.listdir(self.directory):
+            for filename in os.listdir(os.path.join(self.directory, dirname)):
+                if filename != LOCK_FILENAME:
+                    segments.append(os.path.join(dirname, filename))
+        return sorted(segments)
+
+    def test_disabled_without_directory(self):
+        """Test the journal is disabled if no directory is configured."""
+        journal = AnnotationJournal(self.client)
+        journal.init_app(MagicMock(config={}))
+        assert_false(journal.enabled)
+        assert_false(journal.is_pending(self.iri))
+        journal.flush()
+        assert_equal(self.client.mock_calls, [])
+
+    def test_writes_acknowledged_before_sending(self):
+        """Test writes are journalled without being sent."""
+        journal = self.get_journal()
+        annos = [self.get_anno(1, 'foo')]
+        assert_equal(journal.create(self.iri, annos), annos)
+        journal.delete(self.iri, [dict(id='bar')])
+        assert_equal(self.client.mock_calls, [])
+        assert_equal(len(self.get_segments()), 1)
+
+    @patch('pybossa_lc.annotation_journal.os.fsync')
+    def test_fsync_configurable(self, mock_fsync):
+        """Test writes are only synced to disk if configured."""
+        self.get_journal(fsync=False).create(self.iri,
+                                             [self.get_anno(1, 'foo')])
+        assert_equal(mock_fsync.call_count, 0)
+        self.get_journal().create(self.iri, [self.get_anno(2, 'bar')])
+        assert_equal(mock_fsync.call_count, 1)
+
+    def test_flush_sends_writes_in_order(self):
+        """Test consecutive writes of the same type are sent together."""
+        journal = self.get_journal()
+        foo = self.get_anno(1, 'foo')
+        bar = self.get_anno(2, 'bar')
+        old = dict(id='baz')
+        journal.delete(self.iri, [old])
+        journal.create(self.iri, [foo])
+        journal.create(self.iri, [bar])
+        journal.flush()
+        assert_equal(self.client.mock_calls, [
+            call.delete_batch([old]),
+            call.create_batch(self.iri, [foo, bar])
+        ])
+        assert_equal(self.get_segments(), [])
+
+    def test_writes_survive_restart(self):
+        """Test writes journalled by a previous process are sent."""
+        journal = self.get_journal()
+        foo = self.get_anno(1, 'foo')
+        journal.create(self.iri, [foo])
+        self.stop(journal)
+        restarted = self.get_journal()
+        assert_true(restarted.is_pending(self.iri))
+        restarted.flush()
+        self.client.create_batch.assert_called_once_with(self.iri, [foo])
+        assert_false(restarted.is_pending(self.iri))
+
+    def test_running_journal_not_claimed(self):
+        """Test writes journalled by a running process are not taken."""
+        journal = self.get_journal()
+        foo = self.get_anno(1, 'foo')
+        journal.create(self.iri, [foo])
+        other = self.get_journal()
+        assert_false(other.is_pending(self.iri))
+        other.flush()
+        assert_equal(self.client.mock_calls, [])
+        assert_true(journal.is_pending(self.iri))
+
+    def test_orphans_claimed_once(self):
+        """Test writes left by an exited process are only claimed once."""
+        journal = self.get_journal()
+        foo = self.get_anno(1, 'foo')
+        journal.create(self.iri, [foo])
+        self.stop(journal)
+        first = self.get_journal()
+        second = self.get_journal()
+        assert_true(first.is_pending(self.iri))
+        assert_false(second.is_pending(self.iri))
+        assert_equal(len(os.listdir(self.directory)), 2)
+
+    def test_segments_with_same_name_claimed(self):
+        """Test segments with the same name in two orphans are both sent."""
+        foo = self.get_anno(1, 'foo')
+        bar = self.get_anno(2, 'bar')
+        journals = [self.get_journal(), self.get_journal()]
+        for journal, anno in zip(journals, [foo, bar]):
+            journal.create(self.iri, [anno])
+        for journal in journals:
+            self.stop(journal)
+        first, second = [os.path.join(self.directory, segment)
+                         for segment in self.get_segments()]
+        os.rename(second, os.path.join(os.path.dirname(second),
+                                       os.path.basename(first)))
+        self.get_journal().flush()
+        calls = self.client.create_batch.call_args_list
+        assert_equal(len(calls), 2)
+        assert_in(call(self.iri, [foo]), calls)
+        assert_in(call(self.iri, [bar]), calls)
+
+    def test_directory_removed_on_close(self):
+        """Test a process's subdirectory is removed once it is closed."""
+        journal = self.get_journal()
+        journal.create(self.iri, [self.get_anno(1, 'foo')])
+        journal.close()
+        assert_equal(os.listdir(self.directory), [])
+
+    def test_partly_sent_segment_reconciled(self):
+        """Test Annotations sent before a crash are not created again."""
+        journal = self.get_journal()
+        foo = self.get_anno(1, 'foo')
+        bar = self.get_anno(1, 'bar')
+        journal.create(self.iri, [foo, bar])
+        name = self.get_segments()[0]
+        flushing_name = name.replace('.jsonl', '.flushing')
+        os.rename(os.path.join(self.directory, name),
+                  os.path.join(self.directory, flushing_name))
+        self.client.search_annotations.return_value = [
+            dict(foo, id='http://example.com/annotations/results/1')
+        ]
+        journal.flush()
+        self.client.search_annotations.assert_called_once_with(self.iri, {
+            'generator': foo['generator']
+        })
+        self.client.create_batch.assert_called_once_with(self.iri, [bar])
+        assert_equal(self.get_segments(), [])
+
+    def test_failed_flush_retried(self):
+        """Test a segment that failed to be sent is sent by the next flush."""
+        journal = self.get_journal()
+        foo = self.get_anno(1, 'foo')
+        journal.create(self.iri, [foo])
+        self.client.create_batch.side_effect = [HTTPError, None]
+        self.client.search_annotations.return_value = []
+        assert_raises(HTTPError, journal.flush)
+        assert_true(self.get_segments()[0].endswith('.flushing'))
+        assert_true(journal.is_pending(self.iri))
+        journal.flush()
+        assert_equal(self.client.create_batch.call_args_list,
+                     [call(self.iri, [foo]), call(self.iri, [foo])])
+        assert_equal(self.get_segments(), [])
+
+    def test_incomplete_write_ignored(self):
+        """Test a line left incomplete by a crash is ignored."""
+        journal = self.get_journal()
+        foo = self.get_anno(1, 'foo')
+        journal.create(self.iri, [foo])
+        path = os.path.join(self.directory, self.get_segments()[0])
+        with open(path, 'a') as f:
+            f.write('{"op": "create", "coll')
+        self.stop(journal)
+        self.get_journal().flush()
+        self.client.create_batch.assert_called_once_with(self.iri, [foo])
+
+    def test_pending_by_generator(self):
+        """Test pending writes are found by collection and generator."""
+        journal = self.get_journal()
+        foo = self.get_anno(1, 'foo')
+        journal.create(self.iri, [foo])
+        assert_true(journal.is_pending(self.iri))
+        assert_true(journal.is_pending(self.iri, foo['generator'][:1]))
+        assert_true(journal.is_pending(self.iri, foo['generator']))
+        other_task = self.get_anno(2, 'foo')['generator']
+        assert_false(journal.is_pending(self.iri, other_task))
+        assert_false(journal.is_pending('http://example.com/other/'))
+
+    def test_flushed_in_background(self):
+        """Test writes are sent by the background flusher."""
+        journal = self.get_journal(interval=0.01)
+        foo = self.get_anno(1, 'foo')
+        journal.create(self.iri, [foo])
+        for _ in range(100):
+            if not journal.is_pending(self.iri):
+                break
+            time.sleep(0.01)
+        self.client.create_batch.assert_called_once_with(self.iri, [foo])
@@ -0,0 +1,124 @@
+# -*- coding: utf8 -*-
+
+from nose.tools import *
+from mock import MagicMock, patch
+from default import Test
+from requests.exceptions import HTTPError
+
+from pybossa_lc.web_annotation_client import AsyncWebAnnotationClient, gather
+from .fixtures.annotation_server import AnnotationServer
+
+
+class TestAsyncWAClient(Test):
+
+    def setUp(self):
+        super(TestAsyncWAClient, self).setUp()
+        self.server = AnnotationServer(delay=0.02).start()
+        self.collection_iri = self.server.collection_iri('foo')
+        self.client = self.get_client()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        super(TestAsyncWAClient, self).tearDown()
+
+    def get_client(self, **config):
+        app = MagicMock(config=dict({
+            'WEB_ANNOTATION_BASE_URL': self.server.base_url,
+            'WEB_ANNOTATION_POOL_SIZE': 4,
+            'WEB_ANNOTATION_MAX_IN_FLIGHT': 32
+        }, **config))
+        client = AsyncWebAnnotationClient()
+        client.init_app(app)
+        return client
+
+    def test_session_blocks_when_pool_full(self):
+        """Test requests wait for a free connection from the pool."""
+        session = self.client.client.session
+        adapter = session.get_adapter(self.server.base_url)
+        assert_equal(adapter._pool_block, True)
+        assert_equal(adapter._pool_maxsize, 4)
+
+    def test_previous_session_closed_on_init(self):
+        """Test the previous session is closed when reconfigured."""
+        session = self.client.client.session
+        with patch.object(session, 'close') as mock_close:
+            self.client.init_app(self.client.app)
+        assert_equal(mock_close.call_count, 1)
+        assert_not_equal(self.client.client.session, session)
+
+    def test_get_collection(self):
+        """Test an AnnotationCollection is got in the background."""
+        self.server.add(self.collection_iri, {'body': 'foo'})
+        result = self.client.get_collection(self.collection_iri)
+        collection = result.get()
+        assert_equal(collection['id'], self.collection_iri)
+        assert_equal(collection['total'], 1)
+
+    def test_create_annotation(self):
+        """Test an Annotation is created in the background."""
+        result = self.client.create_annotation(self.collection_iri,
+                                               {'body': 'foo'})
+        anno = result.get()
+        assert_equal(anno['body'], 'foo')
+        assert_equal(self.server.annotations, {anno['id']: anno})
+
+    def test_requests_pipelined_over_connection_pool(self):
+        """Test many requests in flight share the connection pool."""
+        results = [self.client.create_annotation(self.collection_iri,
+                                                 {'body': i})
+                   for i in range(32)]
+        annos = gather(results)
+        assert_equal([anno['body'] for anno in annos], range(32))
+        assert_equal(len(self.server.annotations), 32)
+        assert_greater(self.server.max_in_flight, 1)
+        assert_less_equal(self.server.max_in_flight, 4)
+
+    def test_create_batch(self):
+        """Test a batch of Annotations is created in the background."""
+        annos = [{'body': 'foo'}, {'body': 'bar'}]
+        created = self.client.create_batch(self.collection_iri, annos).get()
+        assert_equal([anno['body'] for anno in created], ['foo', 'bar'])
+        assert_equal(len(self.server.annotations), 2)
+
+    def test_delete_batch(self):
+        """Test a batch of Annotations is deleted in the background."""
+        annos = [self.server.add(self.collection_iri, {'body': i})
+                 for i in range(3)]
+        self.client.delete_batch(annos).get()
+        assert_equal(self.server.annotations, {})
+
+    def test_search_annotations(self):
+        """Test Annotations are searched for in the background."""
+        foo = self.server.add(self.collection_iri, {'body': 'foo'})
+        self.server.add(self.collection_iri, {'body': 'bar'})
+        result = self.client.search_annotations(self.collection_iri,
+                                                {'body': 'foo'})
+        assert_equal(result.get(), [foo])
+
+    def test_errors_raised_by_get(self):
+        """Test a failed request raises when its result is got."""
+        batch_iri = self.server.base_url + 'batch/'
+        result = self.client.create_annotation(batch_iri, {'body': 'foo'})
+        assert_raises(HTTPError, result.get)
+
+    def test_gather_waits_for_all_before_raising(self):
+        """Test gather waits for every request before raising an error."""
+        batch_iri = self.server.base_url + 'batch/'
+        results = [
+            self.client.create_annotation(batch_iri, {'body': 'foo'}),
+            self.client.create_annotation(self.collection_iri,
+                                          {'body': 'bar'})
+        ]
+        assert_raises(HTTPError, gather, results)
+        assert_true(all(result.ready() for result in results))
+        assert_equal(len(self.server.annotations), 1)
+
+    def test_close_waits_for_requests_in_flight(self):
+        """Test closing the client waits for requests in flight."""
+        results = [self.client.create_annotation(self.collection_iri,
+                                                 {'body': i})
+                   for i in range(8)]
+        self.client.close()
+        assert_true(all(result.ready() for result in results))
+        assert_equal(len(self.server.annotations), 8)
@@ -174,7 +174,7 @@ class TestBulkTaskIIIFEnhancedImport(Test):
                         'parent_task_id': task.id
                     })
 
-        mock_wa_client.search_annotations.side_effect = return_values
+        mock_wa_client.iter_search_annotations.side_effect = return_values
         importer = BulkTaskIIIFEnhancedImporter(manifest_uri=self.manifest_uri,
                                                 parent_id=parent.id)
         tasks = importer.tasks()
@@ -210,7 +210,7 @@ class TestBulkTaskIIIFEnhancedImport(Test):
 
         importer = BulkTaskIIIFEnhancedImporter(manifest_uri=self.manifest_uri,
                                                 parent_id=parent.id)
-        mock_wa_client.search_annotations.return_value = []
+        mock_wa_client.iter_search_annotations.return_value = []
         tasks = importer.tasks()
 
         results = self.result_repo.filter_by(project_id=parent.id)
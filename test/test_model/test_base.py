@@ -2,18 +2,23 @@
 """Test base model."""
 
 from nose.tools import *
-from mock import patch
+from mock import patch, call
 from default import Test, with_context, flask_app
 from requests.exceptions import HTTPError
 from factories import UserFactory
 from flask import url_for
 from pybossa.model.task import Task
 
-from pybossa_lc.model.base import Base
+from pybossa_lc.model.base import Base, invalidate_collection_cache
 
 
 class TestBaseModel(Test):
 
+    def setUp(self):
+        super(TestBaseModel, self).setUp()
+        invalidate_collection_cache()
+
+    @with_context
     @patch('pybossa_lc.model.base.wa_client')
     def test_iri_checked_on_init(self, mock_client):
         """Test IRI checked on initialisation."""
@@ -21,6 +26,61 @@ class TestBaseModel(Test):
         Base(iri)
         mock_client.get_collection.assert_called_once_with(iri, minimal=True)
 
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_valid_iri_cached(self, mock_client):
+        """Test a valid IRI is only checked once."""
+        iri = 'example.com'
+        Base(iri)
+        Base(iri)
+        mock_client.get_collection.assert_called_once_with(iri, minimal=True)
+
+    @with_context
+    @patch('pybossa_lc.model.base.time')
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_valid_iri_checked_again_when_expired(self, mock_client,
+                                                  mock_time):
+        """Test a valid IRI is checked again once the cache TTL expires."""
+        iri = 'example.com'
+        ttl = flask_app.config.get('WEB_ANNOTATION_COLLECTION_TTL', 300)
+        mock_time.time.return_value = 1000
+        Base(iri)
+        mock_time.time.return_value = 1000 + ttl + 1
+        Base(iri)
+        assert_equal(mock_client.get_collection.call_count, 2)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_invalid_iri_not_cached(self, mock_client):
+        """Test an invalid IRI is checked again."""
+        iri = 'example.com'
+        mock_client.get_collection.side_effect = HTTPError
+        assert_raises(HTTPError, Base, iri)
+        assert_raises(HTTPError, Base, iri)
+        assert_equal(mock_client.get_collection.call_count, 2)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_iri_cache_invalidated(self, mock_client):
+        """Test a valid IRI is checked again after invalidation."""
+        iri = 'example.com'
+        Base(iri)
+        invalidate_collection_cache(iri)
+        Base(iri)
+        assert_equal(mock_client.get_collection.call_count, 2)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_lazy_iri_check(self, mock_client):
+        """Test IRI checked before first use when lazy."""
+        iri = 'example.com'
+        base = Base(iri, lazy=True)
+        assert_equal(mock_client.get_collection.called, False)
+        base._create_annotation({})
+        base._create_annotation({})
+        mock_client.get_collection.assert_called_once_with(iri, minimal=True)
+
+    @with_context
     @patch('pybossa_lc.model.base.wa_client')
     def test_create_annotation(self, mock_client):
         """Test Annotation creted."""
@@ -32,6 +92,50 @@ class TestBaseModel(Test):
         base._create_annotation(anno)
         mock_client.create_annotation.assert_called_once_with(iri, anno)
 
+    @with_context
+    @patch('pybossa_lc.model.base.annotation_journal')
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_write_behind(self, mock_client, mock_journal):
+        """Test writes are journalled in write-behind mode."""
+        iri = 'example.com'
+        anno = {
+            'foo': 'bar'
+        }
+        mock_journal.create.side_effect = lambda iri, annos: annos
+        base = Base(iri, write_behind=True)
+        assert_equal(base._create_annotation(anno), anno)
+        assert_equal(base._create_batch([anno]), [anno])
+        base._delete_batch([anno])
+        assert_equal(mock_journal.create.call_args_list,
+                     [call(iri, [anno]), call(iri, [anno])])
+        mock_journal.delete.assert_called_once_with(iri, [anno])
+        assert_equal(mock_client.create_annotation.called, False)
+        assert_equal(mock_client.create_batch.called, False)
+        assert_equal(mock_client.delete_batch.called, False)
+
+    @with_context
+    @patch('pybossa_lc.model.base.annotation_journal')
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_pending_writes_flushed_before_search(self, mock_client,
+                                                  mock_journal):
+        """Test journalled writes are sent before a search they affect."""
+        iri = 'example.com'
+        generator = [{'id': 'foo'}]
+        base = Base(iri, write_behind=True)
+        mock_journal.is_pending.return_value = False
+        base._search_annotations({'generator': generator})
+        assert_equal(mock_journal.flush.called, False)
+        mock_journal.is_pending.return_value = True
+        base._search_annotations({'generator': generator})
+        mock_journal.is_pending.assert_called_with(iri, generator)
+        assert_equal(mock_journal.flush.call_count, 1)
+
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_write_behind_requires_journal(self, mock_client):
+        """Test write-behind mode requires a journal directory."""
+        assert_raises(ValueError, Base, 'example.com', write_behind=True)
+
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
     def test_get_creator(self, mock_client):
@@ -46,6 +150,25 @@ class TestBaseModel(Test):
             'nickname': user.name
         })
 
+    @with_context
+    @patch('pybossa_lc.model.base.wa_client')
+    def test_reference_bases_resolved_once(self, mock_client):
+        """Test that generator and creator URL bases are only resolved once."""
+        base = Base(None)
+        user = UserFactory.create()
+        with patch('pybossa_lc.model.base.url_for',
+                   wraps=url_for) as mock_url_for:
+            generators = [base._get_generator(i) for i in range(3)]
+            creator = base._get_creator(user)
+        assert_equal(mock_url_for.call_count, 2)
+        assert_equal([gen[1]['id'] for gen in generators],
+                     [url_for('api.api_task', oid=i, _external=True)
+                      for i in range(3)])
+        assert_equal(creator['id'],
+                     url_for('api.api_user', oid=user.id, _external=True))
+        generators[0][0]['id'] = 'foo'
+        assert_not_equal(base._get_generator(1)[0]['id'], 'foo')
+
     @with_context
     @patch('pybossa_lc.model.base.wa_client')
     def test_get_generator(self, mock_client):
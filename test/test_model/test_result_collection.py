@@ -3,14 +3,14 @@
 
 import itertools
 from nose.tools import *
-from mock import patch
+from mock import patch, call, MagicMock
 from default import Test, with_context, flask_app
 from requests.exceptions import HTTPError
 from factories import UserFactory, TaskFactory
 from flask import url_for, current_app
 from pybossa.model.task import Task
 
-from pybossa_lc.model.base import Base
+from pybossa_lc.model.base import Base, invalidate_collection_cache
 from pybossa_lc.model.result_collection import ResultCollection
 
 
@@ -19,6 +19,7 @@ class TestResultCollection(Test):
 
     def setUp(self):
         super(TestResultCollection, self).setUp()
+        invalidate_collection_cache()
         assert_dict_equal.__self__.maxDiff = None
 
     @with_context
@@ -64,6 +65,17 @@ class TestResultCollection(Test):
             'target': target
         })
 
+    @with_context
+    def test_new_comment_with_creator(self, mock_client):
+        """Test that a known creator is used for a new comment."""
+        rc = ResultCollection('example.com')
+        task = TaskFactory()
+        creator = dict(id='http://example.com/user/1', type='Person')
+        anno = rc.new_comment(task, 'foo', 'bar', creator=creator)
+        assert_equal(anno['creator'], creator)
+        anno = rc.new_comment(task, 'foo', 'bar')
+        assert_not_in('creator', anno)
+
     @with_context
     def test_add_tag(self, mock_client):
         """Test that a tagging Annotation is added."""
@@ -255,7 +267,81 @@ class TestResultCollection(Test):
                 }
             ]
         }
-        mock_client.search_annotations.assert_called_once_with(iri, contains)
+        func = mock_client.iter_search_annotations
+        func.assert_called_once_with(iri, contains, prefetch=False)
+
+    @with_context
+    def test_annotations_indexed_by_task(self, mock_client):
+        """Test Annotations for a set of tasks are indexed by task."""
+        iri = 'example.com'
+        rc = ResultCollection(iri)
+        tasks = [Task(id=i, project_id=1) for i in range(1, 4)]
+        annos = [
+            {
+                'id': 'foo',
+                'generator': rc._get_generator(tasks[0].id)
+            },
+            {
+                'id': 'bar',
+                'generator': rc._get_generator(tasks[1].id)
+            },
+            {
+                'id': 'baz',
+                'generator': rc._get_generator(tasks[0].id)
+            },
+            {
+                'id': 'qux',
+                'generator': rc._get_generator(42)
+            }
+        ]
+        mock_client.get_collection.return_value = {'total': len(annos)}
+        mock_client.iter_search_annotations.return_value = iter(annos)
+        index = rc.get_by_task_ids([task.id for task in tasks])
+        assert_dict_equal(index, {
+            tasks[0].id: [annos[0], annos[2]],
+            tasks[1].id: [annos[1]],
+            tasks[2].id: []
+        })
+        contains = {
+            'generator': [
+                {
+                    "id": flask_app.config.get('GITHUB_REPO'),
+                    "type": "Software",
+                    "name": "LibCrowds",
+                    "homepage": flask_app.config.get('SPA_SERVER_NAME')
+                }
+            ]
+        }
+        func = mock_client.iter_search_annotations
+        func.assert_called_once_with(iri, contains, prefetch=True)
+
+    @with_context
+    @patch('pybossa_lc.model.base.async_wa_client')
+    def test_tasks_searched_if_collection_large(self, mock_async_client,
+                                                mock_client):
+        """Test each task is searched for if the collection is large."""
+        iri = 'example.com'
+        rc = ResultCollection(iri)
+        tasks = [Task(id=i, project_id=1) for i in range(1, 3)]
+        page_size = flask_app.config.get('WEB_ANNOTATION_PAGE_SIZE', 100)
+        mock_client.get_collection.return_value = {'total': page_size * 10}
+        mock_async_client.search_annotations.side_effect = [
+            MagicMock(**{'ready.return_value': True,
+                         'get.return_value': [{'id': 'foo'}]}),
+            MagicMock(**{'ready.return_value': True,
+                         'get.return_value': []})
+        ]
+        index = rc.get_by_task_ids([task.id for task in tasks])
+        assert_dict_equal(index, {
+            tasks[0].id: [{'id': 'foo'}],
+            tasks[1].id: []
+        })
+        func = mock_async_client.search_annotations
+        assert_equal(func.call_args_list, [
+            call(iri, {'generator': rc._get_generator(task.id)})
+            for task in tasks
+        ])
+        assert_equal(mock_client.iter_search_annotations.called, False)
 
     @with_context
     def test_batch_delete_annotations(self, mock_client):
@@ -274,6 +360,24 @@ class TestResultCollection(Test):
         rc.delete_batch(annos)
         mock_client.delete_batch.assert_called_once_with(annos)
 
+    @with_context
+    def test_batch_add_annotations(self, mock_client):
+        """Test a batch of Annotations are added."""
+        iri = 'example.com'
+        rc = ResultCollection(iri)
+        task = TaskFactory()
+        annos = [
+            rc.new_comment(task, 'foo', 'bar'),
+            rc.new_tag(task, 'foo', 'baz'),
+            rc.new_transcription(task, 'foo', 'qux', 'quux')
+        ]
+        fake_annos = [dict(id=i) for i in range(len(annos))]
+        mock_client.create_batch.return_value = fake_annos
+        created = rc.add_batch(annos)
+        assert_equal(created, fake_annos)
+        mock_client.create_batch.assert_called_once_with(iri, annos)
+        assert_equal(mock_client.create_annotation.called, False)
+
     @with_context
     def test_transcription_values_validated(self, mock_client):
         """Test validation for required transcription values."""
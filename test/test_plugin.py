@@ -0,0 +1,36 @@
+# -*- coding: utf8 -*-
+
+import os
+from nose.tools import *
+from mock import patch
+from default import Test, with_context, flask_app
+
+import pybossa_lc as plugin
+
+
+class TestPlugin(Test):
+
+    @with_context
+    def test_falsy_settings_not_replaced(self):
+        """Test settings that are set to falsy values keep their values."""
+        plugin_dir = os.path.dirname(plugin.__file__)
+        config = {
+            'WEB_ANNOTATION_MAX_RETRIES': 0,
+            'WEB_ANNOTATION_BACKOFF': 0,
+            'WEB_ANNOTATION_COLLECTION_TTL': 0,
+            'ANALYSIS_WORKERS': 0
+        }
+        with patch.dict(flask_app.config, config):
+            plugin.PyBossaLC(plugin_dir).configure()
+            for key, value in config.items():
+                assert_equal(flask_app.config[key], value)
+
+    @with_context
+    def test_missing_settings_set_to_defaults(self):
+        """Test settings that are not set are given their default values."""
+        plugin_dir = os.path.dirname(plugin.__file__)
+        with patch.dict(flask_app.config):
+            del flask_app.config['WEB_ANNOTATION_MAX_RETRIES']
+            plugin.PyBossaLC(plugin_dir).configure()
+            assert_equal(flask_app.config['WEB_ANNOTATION_MAX_RETRIES'],
+                         plugin.default_settings.WEB_ANNOTATION_MAX_RETRIES)
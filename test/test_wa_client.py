@@ -2,20 +2,37 @@
 
 import json
 from nose.tools import *
-from mock import patch, call
+from mock import patch, call, MagicMock
 from default import Test, flask_app
+from requests.exceptions import HTTPError
 
 from pybossa_lc import wa_client
+from pybossa_lc.web_annotation_client import BatchError
 from .fixtures.response import MockResponse
 
 
-@patch('pybossa_lc.web_annotation_client.requests')
+@patch('pybossa_lc.wa_client.session')
 class TestWAClient(Test):
 
     def setUp(self):
         super(TestWAClient, self).setUp()
+        wa_client._batch_create_supported = None
+        wa_client._batch_delete_supported = None
 
-    def test_create_annotation(self, mock_requests):
+    def test_session_pooled_with_retries(self, mock_session):
+        """Test the session is pooled and retries failed requests."""
+        config = {
+            'WEB_ANNOTATION_POOL_SIZE': 4,
+            'WEB_ANNOTATION_MAX_RETRIES': 2
+        }
+        session = wa_client._get_session(config)
+        adapter = session.get_adapter('https://annotations.example.com')
+        assert_equal(adapter._pool_maxsize, 4)
+        assert_equal(adapter.max_retries.total, 2)
+        assert_equal(adapter.max_retries.status_forcelist,
+                     [500, 502, 503, 504])
+
+    def test_create_annotation(self, mock_session):
         """Test create Annotation."""
         iri = 'example.com'
         anno = {
@@ -28,13 +45,97 @@ class TestWAClient(Test):
             'target': 'bar'
         }
         fake_resp = MockResponse(json.dumps(expected))
-        mock_requests.post.return_value = fake_resp
+        mock_session.post.return_value = fake_resp
 
         result = wa_client.create_annotation(iri, anno)
-        mock_requests.post.assert_called_once_with(iri, json=anno)
+        mock_session.post.assert_called_once_with(iri, json=anno,
+                                                  timeout=wa_client.timeout)
         assert_dict_equal(result, expected)
 
-    def test_get_collection(self, mock_requests):
+    def test_create_batch(self, mock_session):
+        """Test create a batch of Annotations."""
+        iri = 'example.com'
+        annos = [
+            {
+                'body': 'foo',
+                'target': 'bar'
+            },
+            {
+                'body': 'baz',
+                'target': 'qux'
+            }
+        ]
+        expected = [dict(id=i, **anno) for i, anno in enumerate(annos)]
+        fake_resp = MockResponse(json.dumps(expected))
+        mock_session.post.return_value = fake_resp
+        base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
+        endpoint = base_url + '/batch/'
+
+        result = wa_client.create_batch(iri, annos)
+        mock_session.post.assert_called_once_with(endpoint,
+                                                  params={'collection': iri},
+                                                  json=annos,
+                                                  timeout=wa_client.timeout)
+        assert_equal(result, expected)
+
+    def test_create_batch_falls_back_to_single_requests(self, mock_session):
+        """Test create a batch of Annotations without a batch endpoint."""
+        iri = 'example.com'
+        annos = [
+            {
+                'body': 'foo',
+                'target': 'bar'
+            },
+            {
+                'body': 'baz',
+                'target': 'qux'
+            }
+        ]
+        base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
+        endpoint = base_url + '/batch/'
+
+        def fake_post(url, **kwargs):
+            if url == endpoint:
+                return MockResponse(json.dumps({}), status_code=404)
+            return MockResponse(json.dumps(kwargs['json']))
+
+        mock_session.post.side_effect = fake_post
+        result = wa_client.create_batch(iri, annos)
+        assert_equal(result, annos)
+        assert_equal(mock_session.post.call_count, 3)
+        for anno in annos:
+            assert_in(call(iri, json=anno, timeout=wa_client.timeout),
+                      mock_session.post.call_args_list)
+
+        # The batch endpoint should not be tried again
+        mock_session.post.reset_mock()
+        wa_client.create_batch(iri, annos)
+        assert_equal(mock_session.post.call_count, 2)
+
+    def test_create_batch_falls_back_on_error_body(self, mock_session):
+        """Test a missing batch endpoint is detected from a JSON 404."""
+        iri = 'example.com'
+        annos = [
+            {
+                'body': 'foo',
+                'target': 'bar'
+            }
+        ]
+        base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
+        endpoint = base_url + '/batch/'
+        not_found = {'code': 404, 'message': 'Not Found'}
+
+        def fake_post(url, **kwargs):
+            if url == endpoint:
+                return MockResponse(json.dumps(not_found), status_code=404)
+            return MockResponse(json.dumps(kwargs['json']))
+
+        mock_session.post.side_effect = fake_post
+        result = wa_client.create_batch(iri, annos)
+        assert_equal(result, annos)
+        assert_equal(wa_client._batch_create_supported, False)
+
+    def test_get_collection(self, mock_session):
         """Test get AnnotationCollection."""
         iri = 'example.com'
         ns = 'http://www.w3.org/ns/oa#PreferContainedDescriptions'
@@ -46,13 +147,14 @@ class TestWAClient(Test):
             'label': 'bar'
         }
         fake_resp = MockResponse(json.dumps(expected))
-        mock_requests.get.return_value = fake_resp
+        mock_session.get.return_value = fake_resp
 
         result = wa_client.get_collection(iri)
-        mock_requests.get.assert_called_once_with(iri, headers=headers)
+        mock_session.get.assert_called_once_with(iri, headers=headers,
+                                                 timeout=wa_client.timeout)
         assert_dict_equal(result, expected)
 
-    def test_get_prefer_headers(self, mock_requests):
+    def test_get_prefer_headers(self, mock_session):
         """Test get Prefer headers."""
         base = 'return=representation; include="{0}"'
         default = wa_client._get_prefer_headers()
@@ -78,7 +180,7 @@ class TestWAClient(Test):
         ]
         assert_equal(minimal_iris, base.format(' '.join(ns)))
 
-    def test_search_annotations(self, mock_requests):
+    def test_search_annotations(self, mock_session):
         """Test search Annotations."""
         iri = 'example.com/foo'
         ns = [
@@ -94,20 +196,22 @@ class TestWAClient(Test):
             'total': 0
         }
         fake_resp = MockResponse(json.dumps(fake_collection))
-        mock_requests.get.return_value = fake_resp
+        mock_session.get.return_value = fake_resp
         base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
         endpoint = base_url + '/search/'
-        expected_data = {
+        expected_params = {
             'collection': iri,
-            'contains': contains
+            'contains': json.dumps(contains)
         }
 
         result = wa_client.search_annotations(iri, contains)
-        mock_requests.get.assert_called_once_with(endpoint, headers=headers,
-                                                  json=expected_data)
+        mock_session.get.assert_called_once_with(endpoint,
+                                                 params=expected_params,
+                                                 headers=headers,
+                                                 timeout=wa_client.timeout)
         assert_equal(result, [])
 
-    def test_search_annotations_with_pages(self, mock_requests):
+    def test_search_annotations_with_pages(self, mock_session):
         """Test search Annotations with multiple pages."""
         iri = 'example.com/foo'
         ns = [
@@ -132,27 +236,71 @@ class TestWAClient(Test):
             'total': 10,
             'items': [6, 7, 8, 9, 10]
         }
-        mock_requests.get.side_effect = [
+        mock_session.get.side_effect = [
             MockResponse(json.dumps(fake_collection)),
             MockResponse(json.dumps(fake_page1)),
             MockResponse(json.dumps(fake_page2))
         ]
         base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
         endpoint = base_url + '/search/'
-        expected_data = {
+        expected_params = {
             'collection': iri,
-            'contains': contains
+            'contains': json.dumps(contains)
         }
 
         result = wa_client.search_annotations(iri, contains)
-        assert_equal(mock_requests.get.call_args_list, [
-            call(endpoint, headers=headers, json=expected_data),
-            call(fake_collection['first']),
-            call(fake_page1['next'])
+        assert_equal(mock_session.get.call_args_list, [
+            call(endpoint, params=expected_params, headers=headers,
+                 timeout=wa_client.timeout),
+            call(fake_collection['first'], timeout=wa_client.timeout),
+            call(fake_page1['next'], timeout=wa_client.timeout)
         ])
         assert_equal(result, fake_page1['items'] + fake_page2['items'])
 
-    def test_delete_batch(self, mock_requests):
+    def test_iter_search_annotations_with_prefetch(self, mock_session):
+        """Test iterate over search Annotations with pages prefetched."""
+        iri = 'example.com/foo'
+        contains = {'bar': 'baz'}
+        fake_collection = {
+            'total': 10,
+            'first': 'http://annotations.example.com/page1'
+        }
+        fake_page1 = {
+            'total': 10,
+            'items': [1, 2, 3, 4, 5],
+            'next': 'http://annotations.example.com/page2'
+        }
+        fake_page2 = {
+            'total': 10,
+            'items': [6, 7, 8, 9, 10]
+        }
+        mock_session.get.side_effect = [
+            MockResponse(json.dumps(fake_collection)),
+            MockResponse(json.dumps(fake_page1)),
+            MockResponse(json.dumps(fake_page2))
+        ]
+
+        items = wa_client.iter_search_annotations(iri, contains,
+                                                  prefetch=True)
+        assert_equal(mock_session.get.called, False)
+        assert_equal(next(items), 1)
+        assert_equal(list(items), [2, 3, 4, 5, 6, 7, 8, 9, 10])
+        base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
+        headers = {
+            'Prefer': wa_client._get_prefer_headers(minimal=True)
+        }
+        expected_params = {
+            'collection': iri,
+            'contains': json.dumps(contains)
+        }
+        assert_equal(mock_session.get.call_args_list, [
+            call(base_url + '/search/', params=expected_params,
+                 headers=headers, timeout=wa_client.timeout),
+            call(fake_collection['first'], timeout=wa_client.timeout),
+            call(fake_page1['next'], timeout=wa_client.timeout)
+        ])
+
+    def test_delete_batch(self, mock_session):
         """Test delete a batch of Annotations."""
         iri = 'annotations.example.com/foo/bar'
         fake_annos = [
@@ -166,4 +314,114 @@ class TestWAClient(Test):
         base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
         endpoint = base_url + '/batch/'
         wa_client.delete_batch(fake_annos)
-        mock_requests.delete.assert_called_once_with(endpoint, json=fake_annos)
+        mock_session.delete.assert_called_once_with(endpoint, json=fake_annos,
+                                                    timeout=wa_client.timeout)
+
+    def test_delete_batch_falls_back_to_single_requests(self, mock_session):
+        """Test delete a batch of Annotations without a batch endpoint."""
+        fake_annos = [
+            {
+                'id': 'foo'
+            },
+            {
+                'id': 'bar'
+            }
+        ]
+        base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
+        endpoint = base_url + '/batch/'
+        mock_session.delete.side_effect = [
+            MockResponse(json.dumps({}), status_code=404),
+            MockResponse(json.dumps({}), status_code=204),
+            MockResponse(json.dumps({}), status_code=204)
+        ]
+        wa_client.delete_batch(fake_annos)
+        assert_equal(mock_session.delete.call_count, 3)
+        for anno in fake_annos:
+            assert_in(call(anno['id'], timeout=wa_client.timeout),
+                      mock_session.delete.call_args_list)
+
+    def test_delete_batch_falls_back_on_error_body(self, mock_session):
+        """Test a JSON 404 without item errors means no batch endpoint."""
+        not_found = {'code': 404, 'message': 'Not Found'}
+        mock_session.delete.side_effect = [
+            MockResponse(json.dumps(not_found), status_code=404),
+            MockResponse(json.dumps({}), status_code=204)
+        ]
+        wa_client.delete_batch([{'id': 'foo'}])
+        assert_equal(mock_session.delete.call_count, 2)
+        assert_equal(wa_client._batch_delete_supported, False)
+
+    def test_delete_batch_with_missing_items(self, mock_session):
+        """Test a batch with missing Annotations is deleted one at a time."""
+        fake_annos = [
+            {
+                'id': 'foo'
+            },
+            {
+                'id': 'bar'
+            }
+        ]
+        item_errors = {
+            'errors': [{'id': 'foo', 'status': 404}]
+        }
+        mock_session.delete.side_effect = [
+            MockResponse(json.dumps(item_errors), status_code=404),
+            MockResponse(json.dumps({}), status_code=404),
+            MockResponse(json.dumps({}), status_code=204)
+        ]
+        wa_client.delete_batch(fake_annos)
+        assert_equal(mock_session.delete.call_count, 3)
+        assert_equal(wa_client._batch_delete_supported, True)
+        assert_equal(wa_client._batch_create_supported, None)
+
+    def test_batch_support_checked_per_operation(self, mock_session):
+        """Test a missing delete endpoint does not stop batch creation."""
+        iri = 'example.com'
+        annos = [
+            {
+                'body': 'foo',
+                'target': 'bar'
+            }
+        ]
+        mock_session.delete.side_effect = [
+            MockResponse(json.dumps({}), status_code=405),
+            MockResponse(json.dumps({}), status_code=204)
+        ]
+        mock_session.post.return_value = MockResponse(json.dumps(annos))
+        wa_client.delete_batch([{'id': 'foo'}])
+        wa_client.create_batch(iri, annos)
+        base_url = flask_app.config.get('WEB_ANNOTATION_BASE_URL')
+        endpoint = base_url + '/batch/'
+        mock_session.post.assert_called_once_with(endpoint,
+                                                  params={'collection': iri},
+                                                  json=annos,
+                                                  timeout=wa_client.timeout)
+
+    def test_delete_batch_errors_collected(self, mock_session):
+        """Test all Annotations attempted before batch errors raised."""
+        wa_client._batch_delete_supported = False
+        fake_annos = [
+            {
+                'id': 'foo'
+            },
+            {
+                'id': 'bar'
+            },
+            {
+                'id': 'baz'
+            }
+        ]
+        err = HTTPError('500 Server Error')
+
+        def fake_delete(iri, **kwargs):
+            resp = MagicMock(status_code=200)
+            if iri != 'bar':
+                resp.raise_for_status.side_effect = err
+            return resp
+
+        mock_session.delete.side_effect = fake_delete
+        with assert_raises(BatchError) as exc:
+            wa_client.delete_batch(fake_annos)
+        assert_equal(mock_session.delete.call_count, 3)
+        failed = sorted(anno['id'] for anno, _err in exc.exception.errors)
+        assert_equal(failed, ['baz', 'foo'])